@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+import array
+import functools
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "decision_cache.db"
+DEFAULT_TTL = 7 * 24 * 60 * 60  # One week, in seconds
+# Emails at least this similar to a cached one share its decision
+DEFAULT_SIMILARITY = 0.9
+
+# Start of the quoted history in a reply, e.g. "On Mon, ... wrote:",
+# possibly wrapped over two lines
+_REPLY_HISTORY_RE = re.compile(
+    r"^(?:On\b[^\n]*(?:\n[^\n]*)?\bwrote:[ \t]*$"
+    r"|-+ ?Original Message ?-+)",
+    re.MULTILINE | re.IGNORECASE
+)
+_QUOTED_LINE_RE = re.compile(r"^[ \t]*>.*\n?", re.MULTILINE)
+_SPACES_RE = re.compile(r"[ \t\xa0]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def strip_noise(body):
+    """
+    Drop the quoted history of a reply and fold redundant whitespace,
+    which would only cost the model tokens.
+    """
+    history = _REPLY_HISTORY_RE.search(body)
+    if history:
+        body = body[:history.start()]
+    body = _QUOTED_LINE_RE.sub("", body)
+    body = _SPACES_RE.sub(" ", body)
+    return _BLANK_LINES_RE.sub("\n\n", body).strip()
+
+
+def normalize(email_text):
+    """
+    Normalize email text so that trivially different re-sends of the same
+    email share a cache entry.
+
+    The noise strip_noise() drops from the prompt is dropped here too, and
+    the remaining runs of whitespace are folded into a single space.
+    """
+    return _WHITESPACE_RE.sub(" ", strip_noise(email_text)).strip()
+
+
+class _SQLiteCache:
+    """
+    Base class of the decision caches: a SQLite connection shared between
+    threads, and the scope of the decisions it holds. Decisions made with
+    another model or system prompt are never reused.
+    """
+
+    def __init__(self, model, system_prompt, path=DEFAULT_CACHE_PATH,
+                 ttl=DEFAULT_TTL):
+        """
+        Open the database.
+
+        Args:
+            model: Name of the model making the decisions
+            system_prompt: System prompt sent with every email
+            path: Path to the SQLite database file
+            ttl: Seconds after which a cached decision expires
+        """
+        self.model = model
+        self.system_prompt = system_prompt
+        self.ttl = ttl
+        self.scope = hashlib.sha256(
+            f"{model}\0{system_prompt}".encode()
+        ).hexdigest()
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        """
+        Context manager entry point.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Context manager exit point.
+        """
+        self.close()
+
+
+class DecisionCache(_SQLiteCache):
+    """
+    An on-disk cache of AI decisions, keyed by a SHA-256 hash of the model,
+    the system prompt and the normalized email text.
+    Safe to share between threads.
+    """
+
+    def __init__(self, model, system_prompt, path=DEFAULT_CACHE_PATH,
+                 ttl=DEFAULT_TTL):
+        """
+        Initialize the decision cache.
+
+        Args:
+            model: Name of the model making the decisions
+            system_prompt: System prompt sent with every email
+            path: Path to the SQLite database file
+            ttl: Seconds after which a cached decision expires
+        """
+        super().__init__(model, system_prompt, path, ttl)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, decision TEXT, ts INTEGER)"
+        )
+        self.conn.commit()
+
+    def key(self, email_text):
+        """
+        Build the cache key for an email.
+
+        Args:
+            email_text: The parsed email text sent to the model
+
+        Returns:
+            str: Hex SHA-256 digest identifying the decision
+        """
+        material = (
+            f"{self.model}\0{self.system_prompt}\0{normalize(email_text)}"
+        )
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, email_text):
+        """
+        Look up a cached decision for an email.
+
+        Args:
+            email_text: The parsed email text sent to the model
+
+        Returns:
+            str: The cached decision, or None if missing or expired
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT decision FROM cache WHERE key = ? AND ts > ?",
+                (self.key(email_text), int(time.time()) - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, email_text, decision):
+        """
+        Store the decision made for an email.
+
+        Args:
+            email_text: The parsed email text sent to the model
+            decision: Decision text returned by the model
+        """
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, decision, ts) "
+                "VALUES (?, ?, ?)",
+                (self.key(email_text), decision, int(time.time()))
+            )
+            self.conn.commit()
+
+class MessageIdCache(_SQLiteCache):
+    """
+    An on-disk cache of AI decisions keyed by the email's Message-ID, so
+    emails seen before (re-runs, replayed folders, copies in several
+    accounts) are never sent to the model again.
+    New decisions are buffered and written in one transaction by flush()
+    or close(). Safe to share between threads.
+    """
+
+    def __init__(self, model, system_prompt, path=DEFAULT_CACHE_PATH,
+                 ttl=DEFAULT_TTL):
+        """
+        Initialize the Message-ID cache.
+
+        Args:
+            model: Name of the model making the decisions
+            system_prompt: System prompt sent with every email
+            path: Path to the SQLite database file
+            ttl: Seconds after which a cached decision expires
+        """
+        super().__init__(model, system_prompt, path, ttl)
+        self._pending = {}
+        # Readers don't block the writer and commits need fewer fsyncs
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Decisions in the old, unscoped table may come from another
+        # model or prompt
+        self.conn.execute("DROP TABLE IF EXISTS decisions")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_decisions "
+            "(scope TEXT, message_id TEXT, decision TEXT, ts INTEGER, "
+            "PRIMARY KEY (scope, message_id))"
+        )
+        self.conn.commit()
+
+    def get(self, message_id):
+        """
+        Look up the decision made for an email.
+
+        Args:
+            message_id: The email's Message-ID header
+
+        Returns:
+            str: The cached decision, or None if missing or expired
+        """
+        if not message_id:
+            return None
+        with self._lock:
+            if message_id in self._pending:
+                return self._pending[message_id][0]
+            row = self.conn.execute(
+                "SELECT decision FROM message_decisions "
+                "WHERE scope = ? AND message_id = ? AND ts > ?",
+                (self.scope, message_id, int(time.time()) - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, message_id, decision):
+        """
+        Remember the decision made for an email until the next flush().
+
+        Args:
+            message_id: The email's Message-ID header
+            decision: Decision text returned by the model
+        """
+        if not message_id:
+            return
+        with self._lock:
+            self._pending[message_id] = (decision, int(time.time()))
+
+    def flush(self):
+        """
+        Write the buffered decisions to the database.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO message_decisions "
+                "(scope, message_id, decision, ts) VALUES (?, ?, ?, ?)",
+                [(self.scope, message_id, decision, ts)
+                 for message_id, (decision, ts) in self._pending.items()]
+            )
+            self.conn.commit()
+            self._pending.clear()
+
+    def close(self):
+        """
+        Write the buffered decisions and close the database connection.
+        """
+        self.flush()
+        super().close()
+
+
+def _to_unit_vector(embedding):
+    """Scale an embedding to length 1, so a dot product is its cosine."""
+    norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+    return array.array("f", (x / norm for x in embedding))
+
+
+def _quantize(vector):
+    """
+    Quantize a vector to int8, a quarter of the float32 size. The largest
+    component maps to +/-127 so the whole int8 range is used.
+    """
+    peak = max((abs(x) for x in vector), default=0.0) or 1.0
+    return array.array("b", (round(x * 127 / peak) for x in vector))
+
+
+def _cosine_scale(quantized):
+    """
+    Return the factor turning the dot product of a unit vector with a
+    quantized vector into their cosine similarity.
+    """
+    return 1.0 / (math.sqrt(sum(x * x for x in quantized)) or 1.0)
+
+
+class SemanticDecisionCache(_SQLiteCache):
+    """
+    An on-disk cache of AI decisions looked up by email similarity, so
+    near-duplicate emails (newsletters, notifications, receipts) reuse
+    the decision made for an earlier one.
+    Safe to share between threads.
+    """
+
+    def __init__(self, model, system_prompt, embed, path=DEFAULT_CACHE_PATH,
+                 ttl=DEFAULT_TTL, threshold=DEFAULT_SIMILARITY):
+        """
+        Initialize the semantic decision cache.
+
+        Args:
+            model: Name of the model making the decisions
+            system_prompt: System prompt sent with every email
+            embed: Function returning the embedding vector of a text
+            path: Path to the SQLite database file
+            ttl: Seconds after which a cached decision expires
+            threshold: Minimum cosine similarity for a cache hit
+        """
+        super().__init__(model, system_prompt, path, ttl)
+        self.threshold = threshold
+        # get() and set() are called with the same text, embed it once
+        self._embed = functools.lru_cache(maxsize=64)(embed)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache "
+            "(scope TEXT, embedding BLOB, decision TEXT, ts INTEGER)"
+        )
+        self.conn.execute(
+            "DELETE FROM semantic_cache WHERE ts <= ?",
+            (int(time.time()) - ttl,)
+        )
+        self.conn.commit()
+
+        # Similarity is computed in Python, so keep the vectors in memory.
+        # They are stored as int8; only the query vector stays float.
+        self._entries = []
+        rows = self.conn.execute(
+            "SELECT embedding, decision, ts FROM semantic_cache "
+            "WHERE scope = ?", (self.scope,)
+        )
+        for blob, decision, ts in rows:
+            quantized = array.array("b")
+            quantized.frombytes(blob)
+            self._entries.append(
+                (quantized, _cosine_scale(quantized), decision, ts)
+            )
+
+    def get(self, email_text):
+        """
+        Look up the decision made for the most similar cached email.
+
+        Args:
+            email_text: The parsed email text sent to the model
+
+        Returns:
+            str: The cached decision, or None if no unexpired email is
+            similar enough
+        """
+        vector = _to_unit_vector(self._embed(normalize(email_text)))
+        oldest = int(time.time()) - self.ttl
+        best, best_similarity = None, self.threshold
+        with self._lock:
+            entries = list(self._entries)
+        for cached, scale, decision, ts in entries:
+            if ts <= oldest or len(cached) != len(vector):
+                continue
+            similarity = scale * sum(a * b for a, b in zip(cached, vector))
+            if similarity >= best_similarity:
+                best, best_similarity = decision, similarity
+        return best
+
+    def set(self, email_text, decision):
+        """
+        Store the decision made for an email.
+
+        Args:
+            email_text: The parsed email text sent to the model
+            decision: Decision text returned by the model
+        """
+        quantized = _quantize(
+            _to_unit_vector(self._embed(normalize(email_text)))
+        )
+        ts = int(time.time())
+        with self._lock:
+            # Drop expired decisions, so a long-running daemon doesn't
+            # keep scanning them
+            oldest = ts - self.ttl
+            self._entries = [
+                entry for entry in self._entries if entry[3] > oldest
+            ]
+            self._entries.append(
+                (quantized, _cosine_scale(quantized), decision, ts)
+            )
+            self.conn.execute(
+                "DELETE FROM semantic_cache WHERE ts <= ?", (oldest,)
+            )
+            self.conn.execute(
+                "INSERT INTO semantic_cache (scope, embedding, decision, ts) "
+                "VALUES (?, ?, ?, ?)",
+                (self.scope, quantized.tobytes(), decision, ts)
+            )
+            self.conn.commit()
@@ -1,13 +1,27 @@
 #!/usr/bin/env python
 
 import email.utils
+import html
+import itertools
+import json
+import os
+import queue
 import re
 import logging
 import argparse
 import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from decision_cache import DecisionCache, strip_noise
 from imap_connector import IMAPConnector
+from prompts import (
+    SYSTEM_PROMPT, SYSTEM_PROMPT_TOKEN_COUNT, BATCH_INSTRUCTIONS,
+    DECISION_SCHEMA, BATCH_DECISION_SCHEMA
+)
 import requests
+from requests.adapters import HTTPAdapter
 
 # Setup logging
 logging.basicConfig(
@@ -17,50 +31,263 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OLLAMA_EMBED_URL = "http://localhost:11434/api/embeddings"
 MODEL_NAME = "qwen3:14b"  # Replace with the model you've loaded
+EMBED_MODEL_NAME = "nomic-embed-text"  # Used by the semantic cache
+OLLAMA_TIMEOUT = (10, 300)  # (connect, read) seconds
+# Concurrent Ollama requests; match the server's OLLAMA_NUM_PARALLEL
+NUM_PARALLEL = max(int(os.getenv("NUM_PARALLEL", 4)), 1)
+QUEUE_SIZE = 4  # Batches buffered ahead of the Ollama workers
+
+# A complete action in a partially streamed JSON response
+_STREAM_ACTION_RE = re.compile(r'"action"\s*:\s*"(\w+)"', re.IGNORECASE)
+# Target folder for each action
+_ACTION_FOLDERS = {
+    "archive": "Archives",
+    "important": "INBOX/Important",
+    "newsletter": "Newsletters",
+    "spam": "Spam",
+    "trash": "Trash"
+}
 
-# Define your criteria as part of the system prompt
-SYSTEM_PROMPT = """
-You are an assistant that helps manage emails. Based on the content of the
-email and the user's rules, decide whether to "archive", "flag", or "reply".
-Return your decision in the format: Action: <archive|important|newsletter>.
-Reason: <brief reason>.
-User rules:
-- Archive notifications in 'Archives' folder unless urgent
-- If there's a direct question move the email to 'INBOX/Important'
-- Move emails that seem personal or urgent to 'INBOX/Important'
-- Flag newsletters by moving them to 'Newsletters' folder
-"""
+# Longest email text sent to Ollama; enough to classify any email
+MAX_EMAIL_CHARS = 2000
+# Longer emails get a request of their own, so a batch of them always
+# fits in num_ctx along with the prompt and the answer
+BATCH_EMAIL_MAX_CHARS = 1500
+_HTML_HIDDEN_RE = re.compile(
+    r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+IMAP_MONTHS = (
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"
+)
+
+# Reuse keep-alive connections to Ollama for every generate call, one
+# per worker so concurrent requests never open throwaway connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=1, pool_maxsize=NUM_PARALLEL, max_retries=0
+    )
+)
+_SESSION.headers.update({
+    "Connection": "keep-alive",
+    "Accept-Encoding": "gzip, deflate"
+})
+
+# Keep the loaded model and the cached system prompt prefix around
+# between emails
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_OPTIONS = {
+    "num_ctx": 4096,
+    "num_keep": SYSTEM_PROMPT_TOKEN_COUNT
+}
+# The action comes first, so a single decision never needs many tokens
+DECISION_MAX_TOKENS = 32
 
 
 def query_ollama(email_text):
-    """Query Ollama API to get a decision on email handling."""
+    """
+    Query Ollama API to get a decision on email handling.
+    
+    The response is streamed and the connection closed as soon as the
+    action has been generated, so Ollama stops before writing the reason.
+    
+    Returns:
+        str: The decision as JSON; the reason is left out when the
+        response was cut short
+        
+    Raises:
+        ValueError: If Ollama reports an error or the response holds no
+        action
+    """
     payload = {
         "model": MODEL_NAME,
         "prompt": f"{SYSTEM_PROMPT}\n\nEmail:\n{email_text}",
-        "stream": False
+        "format": DECISION_SCHEMA,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {**OLLAMA_OPTIONS, "num_predict": DECISION_MAX_TOKENS}
+    }
+    response = _SESSION.post(
+        OLLAMA_API_URL, json=payload, timeout=OLLAMA_TIMEOUT, stream=True
+    )
+    try:
+        response.raise_for_status()
+        decision = ""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise ValueError(f"Ollama error: {chunk['error']}")
+            decision += chunk.get("response", "")
+            
+            action_match = _STREAM_ACTION_RE.search(decision)
+            if action_match:
+                return json.dumps({"action": action_match.group(1)})
+            if chunk.get("done"):
+                break
+        raise ValueError(f"No action in Ollama response: {decision!r}")
+    finally:
+        # Closing mid-stream drops the connection, which makes Ollama
+        # cancel the rest of the generation
+        response.close()
+
+
+def embed_text(text):
+    """
+    Get the embedding vector of a text from Ollama.
+
+    Returns:
+        list: The embedding, as floats
+    """
+    payload = {
+        "model": EMBED_MODEL_NAME,
+        "prompt": text,
+        "keep_alive": OLLAMA_KEEP_ALIVE
     }
-    response = requests.post(OLLAMA_API_URL, json=payload)
+    response = _SESSION.post(
+        OLLAMA_EMBED_URL, json=payload, timeout=OLLAMA_TIMEOUT
+    )
     response.raise_for_status()
-    return response.json()["response"]
+    return response.json()["embedding"]
+
+
+def query_ollama_batch(items):
+    """
+    Query Ollama API once to get decisions for a batch of emails.
+
+    Args:
+        items: List of (email_id, email_text) tuples
+
+    Returns:
+        dict: Decision JSON keyed by email ID, in the same format
+        returned by query_ollama. Emails the model did not answer for
+        are missing from the dict.
+    """
+    emails = "\n---\n".join(
+        f"[{email_id}] {email_text}" for email_id, email_text in items
+    )
+    payload = {
+        "model": MODEL_NAME,
+        "prompt": f"{SYSTEM_PROMPT}\n\nEmails:\n{emails}\n"
+                  f"{BATCH_INSTRUCTIONS}",
+        "format": BATCH_DECISION_SCHEMA,
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": OLLAMA_OPTIONS
+    }
+    response = _SESSION.post(
+        OLLAMA_API_URL, json=payload, timeout=OLLAMA_TIMEOUT
+    )
+    response.raise_for_status()
+    
+    result = json.loads(response.json()["response"])
+    if isinstance(result, dict):
+        result = result.get("decisions", [])
+        
+    decisions = {}
+    for entry in result:
+        if not isinstance(entry, dict) or "action" not in entry:
+            continue
+        decisions[str(entry.get("id"))] = json.dumps({
+            "action": entry["action"],
+            "reason": entry.get("reason", "")
+        })
+    return decisions
+
+
+def _decode_part(part):
+    """Decode a message part's payload using its declared charset."""
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(
+            part.get_content_charset() or "utf-8", errors="ignore"
+        )
+    except LookupError:
+        # Unknown charset name
+        return payload.decode("utf-8", errors="ignore")
+
+
+def _html_to_text(html_body):
+    """Roughly convert an HTML body to text by dropping the markup."""
+    text = _HTML_HIDDEN_RE.sub(" ", html_body)
+    return html.unescape(_HTML_TAG_RE.sub(" ", text))
 
 
 def parse_email(msg):
-    """Parse an email message into text format."""
+    """
+    Parse an email message into text format.
+    
+    The body is the first text/plain part, or the first text/html part
+    with its markup stripped if there is none. Quoted replies and extra
+    whitespace are dropped, and the text is cut to MAX_EMAIL_CHARS, as
+    the start of an email is enough to classify it.
+    """
     subject = msg.get("subject", "(no subject)")
     from_ = msg.get("from", "")
     body = ""
     if msg.is_multipart():
+        # Use the first text/plain part only, like mail clients do
+        html_part = None
         for part in msg.walk():
             if part.get_content_type() == "text/plain":
-                body += part.get_payload(decode=True).decode(errors="ignore")
+                body = _decode_part(part)
+                break
+            if html_part is None and part.get_content_type() == "text/html":
+                html_part = part
+        else:
+            if html_part is not None:
+                body = _html_to_text(_decode_part(html_part))
     else:
         try:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
+            body = _decode_part(msg)
+            if msg.get_content_type() == "text/html":
+                body = _html_to_text(body)
         except Exception:
             body = msg.get_payload(decode=False)
             
-    return f"From: {from_}\nSubject: {subject}\n\n{body}"
+    text = f"From: {from_}\nSubject: {subject}\n\n{strip_noise(body)}"
+    if len(text) > MAX_EMAIL_CHARS:
+        text = text[:MAX_EMAIL_CHARS] + "\n...[truncated]"
+    return text
+
+
+def parse_action(decision):
+    """
+    Extract the lowercased action from a JSON decision. Returns None if
+    there is no decision, it is not valid JSON or it has no action.
+    """
+    try:
+        return str(json.loads(decision)["action"]).lower()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def decide_folder(decision):
+    """
+    Work out which folder a decision from Ollama sends an email to.
+    
+    Args:
+        decision: Decision JSON from Ollama
+        
+    Returns:
+        str: The target folder, or None if the email should stay put
+    """
+    action = parse_action(decision)
+    if not action:
+        logger.warning(f"Could not parse action from decision: {decision}")
+        return None
+    
+    target_folder = _ACTION_FOLDERS.get(action)
+    if not target_folder:
+        logger.info(f"No folder change needed for action: {action}")
+    return target_folder
 
 
 def process_email_decision(decision, email_id, imap_connector, dry_run=False):
@@ -69,7 +296,7 @@ def process_email_decision(decision, email_id, imap_connector, dry_run=False):
     folder.
     
     Args:
-        decision: Decision text from Ollama
+        decision: Decision JSON from Ollama
         email_id: Email ID to act upon
         imap_connector: IMAPConnector instance
         dry_run: If True, don't actually move emails
@@ -77,31 +304,8 @@ def process_email_decision(decision, email_id, imap_connector, dry_run=False):
     Returns:
         str: The folder the email was moved to, or None if not moved
     """
-    action_match = re.search(r"Action:\s*(\w+)", decision)
-    if not action_match:
-        logger.warning(f"Could not parse action from decision: {decision}")
-        return None
-        
-    action = action_match.group(1).lower()
-    
-    # Determine target folder based on action
-    target_folder = None
-    
-    if action == "archive":
-        target_folder = "Archives"
-    elif (action == "important" or
-          (action == "flag" and "important" in decision.lower())):
-        target_folder = "INBOX/Important"
-    elif (action == "newsletter" or
-          (action == "flag" and "newsletter" in decision.lower())):
-        target_folder = "Newsletters"
-    elif action == "spam" or "spam" in decision.lower():
-        target_folder = "Spam"
-    elif action == "trash" or "trash" in decision.lower():
-        target_folder = "Trash"
-        
+    target_folder = decide_folder(decision)
     if not target_folder:
-        logger.info(f"No folder change needed for action: {action}")
         return None
         
     if dry_run:
@@ -151,6 +355,19 @@ def setup_argparser():
         help="Path to .env file with IMAP credentials (default: .env)"
     )
     
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of emails classified per Ollama request (default: 8)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always ask Ollama, ignoring previously cached decisions"
+    )
+    
     parser.add_argument(
         "--today-only",
         action="store_true",
@@ -160,21 +377,237 @@ def setup_argparser():
     return parser
 
 
+def imap_date(dt):
+    """Format a date for IMAP SEARCH criteria, e.g. 01-Jan-2025."""
+    # Month names must be English regardless of locale, so no strftime
+    return f"{dt.day:02d}-{IMAP_MONTHS[dt.month - 1]}-{dt.year}"
+
+
+def is_from_today(msg, email_id, today):
+    """
+    Check whether an email was sent today, based on its Date header.
+
+    Args:
+        msg: The email message object
+        email_id: Email ID, used for logging
+        today: Today's date in the local timezone
+
+    Returns:
+        bool: True if the email is from today, False otherwise
+    """
+    date_hdr = msg.get('Date')
+    if not date_hdr:
+        logger.info(f"Skipping email {email_id} (no date header)")
+        return False
+
+    try:
+        msg_dt = email.utils.parsedate_to_datetime(date_hdr)
+        # Compare in the local timezone whatever the sender's timezone;
+        # dates without one are assumed to be local already
+        if msg_dt.tzinfo is not None:
+            msg_dt = msg_dt.astimezone()
+
+        if msg_dt.date() != today:
+            logger.info(f"Skipping email {email_id} (not from today)")
+            return False
+    except Exception as e:
+        logger.warning(
+            f"Skipping email {email_id} (date parsing error): {e}"
+        )
+        return False
+
+    return True
+
+
+def _fetch_emails(imap, email_ids, today_only, batch_size, cache, q_in,
+                  q_out, num_workers):
+    """
+    Fetch and parse emails, feeding them in batches to the Ollama workers.
+
+    Emails that fail to fetch, are skipped or have a cached decision are
+    reported straight to q_out, so the consumer sees exactly one result
+    per email ID.
+    """
+    try:
+        today = datetime.now().date()
+        ids = iter(email_ids)
+        while True:
+            chunk = list(itertools.islice(ids, batch_size))
+            if not chunk:
+                break
+                
+            try:
+                if today_only:
+                    # Check dates on the headers alone before fetching
+                    # bodies
+                    headers = imap.get_emails_headers(chunk, "DATE")
+                    wanted = []
+                    for email_id in chunk:
+                        msg = headers.get(email_id)
+                        if not msg:
+                            q_out.put(
+                                (email_id, None, "failed to fetch email")
+                            )
+                        elif not is_from_today(msg, email_id, today):
+                            q_out.put((email_id, None, None))
+                        else:
+                            wanted.append(email_id)
+                    chunk = wanted
+                    
+                # Fetch the whole chunk in one server round-trip
+                messages = imap.get_emails(chunk)
+            except Exception as e:
+                # The consumer still expects a result for every email
+                for email_id in chunk:
+                    q_out.put((email_id, None, e))
+                continue
+            batch = []
+            for email_id in chunk:
+                try:
+                    msg = messages.get(email_id)
+                    if not msg:
+                        q_out.put((email_id, None, "failed to fetch email"))
+                        continue
+
+                    email_text = parse_email(msg)
+                    decision = cache.get(email_text) if cache else None
+                    # An empty or garbled cached decision counts as a miss
+                    if decision is not None and parse_action(decision):
+                        logger.info(
+                            f"Cached decision for email {email_id}: "
+                            f"{decision}"
+                        )
+                        q_out.put((email_id, decision, None))
+                        continue
+
+                    batch.append((email_id, email_text))
+                except Exception as e:
+                    q_out.put((email_id, None, e))
+                    
+            if batch:
+                q_in.put(batch)
+    finally:
+        # One sentinel per worker so they all shut down
+        for _ in range(num_workers):
+            q_in.put(None)
+
+
+def classify_batch(items):
+    """
+    Get decisions for a group of emails, asking about all the short ones
+    with a single Ollama request.
+    
+    Emails longer than BATCH_EMAIL_MAX_CHARS, emails the model left out
+    and, if the batch request fails, all of the emails are asked about
+    one by one.
+    
+    Args:
+        items: List of (email_id, email_text) tuples
+        
+    Returns:
+        list: (email ID, decision, error) tuples, in the order of items;
+        the decision is None when there is an error
+    """
+    batch = [
+        (email_id, email_text) for email_id, email_text in items
+        if len(email_text) <= BATCH_EMAIL_MAX_CHARS
+    ]
+    decisions = {}
+    if len(batch) > 1:
+        ids = ", ".join(email_id for email_id, _ in batch)
+        logger.info(f"Processing emails {ids}")
+        try:
+            decisions = query_ollama_batch(batch)
+        except Exception as e:
+            logger.warning(
+                f"Batch query failed, querying emails one by one: {e}"
+            )
+    
+    results = []
+    for email_id, email_text in items:
+        try:
+            decision = decisions.get(email_id)
+            if decision is None:
+                logger.info(f"Processing email {email_id}")
+                decision = query_ollama(email_text)
+            logger.info(f"AI Decision for email {email_id}: {decision}")
+            if not parse_action(decision):
+                raise ValueError(f"Unparseable decision: {decision!r}")
+            results.append((email_id, decision, None))
+        except Exception as e:
+            results.append((email_id, None, e))
+    return results
+
+
+def _query_worker(q_in, q_out, cache):
+    """Get decisions from Ollama for batches of emails until a sentinel."""
+    while True:
+        batch = q_in.get()
+        if batch is None:
+            return
+
+        for (email_id, email_text), result in zip(
+            batch, classify_batch(batch)
+        ):
+            _, decision, error = result
+            if cache and error is None:
+                try:
+                    cache.set(email_text, decision)
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to cache decision for email {email_id}: {e}"
+                    )
+            q_out.put(result)
+
+
+def open_cache(args, cache_type=DecisionCache, **kwargs):
+    """
+    Open a decision cache scoped to MODEL_NAME and SYSTEM_PROMPT, or a
+    no-op context if caching is disabled with --no-cache.
+    
+    Args:
+        args: The parsed command-line arguments
+        cache_type: The decision cache class to open
+        **kwargs: More arguments for the cache class
+    """
+    if args.no_cache:
+        return nullcontext()
+    return cache_type(
+        model=MODEL_NAME, system_prompt=SYSTEM_PROMPT, **kwargs
+    )
+
+
 def process_imap_emails(args):
-    """Process emails from IMAP server using Ollama AI."""
+    """
+    Process emails from IMAP server using Ollama AI.
+
+    Fetching, Ollama queries and moves run as a pipeline: one thread
+    fetches emails in batches of args.batch_size, NUM_PARALLEL workers
+    query Ollama once per batch, and the calling thread moves emails
+    over a second IMAP connection, so moves don't wait for fetches.
+    """
     try:
-        with IMAPConnector(env_path=args.env_file) as imap:
-            if not imap.logged_in:
+        with open_cache(args) as cache, \
+                IMAPConnector(env_path=args.env_file) as imap, \
+                IMAPConnector(env_path=args.env_file) as mover:
+            if not (imap.logged_in and mover.logged_in):
                 logger.error("Failed to connect to IMAP server")
                 return 1
                 
             # Select the source folder
-            if not imap.select_folder(args.folder):
+            if not (imap.select_folder(args.folder) and
+                    mover.select_folder(args.folder)):
                 logger.error(f"Failed to select folder: {args.folder}")
                 return 1
                 
             # Search for unread emails (you can change this criteria)
-            email_ids = imap.search_emails('UNSEEN')
+            criteria = 'UNSEEN'
+            if args.today_only:
+                # Let the server drop older emails; SINCE only has day
+                # granularity in the server's timezone, so is_from_today
+                # still checks each email that comes back
+                criteria = f'(UNSEEN SINCE {imap_date(datetime.today())})'
+            email_ids = imap.search_emails(criteria)
             logger.info(
                 f"Found {len(email_ids)} unread emails in {args.folder}"
             )
@@ -186,78 +619,51 @@ def process_imap_emails(args):
                 logger.info("No emails to process")
                 return 0
                 
-            results = {
-                "processed": 0,
-                "moved": 0,
-                "errors": 0,
-                "by_folder": {}
-            }
+            results = Counter()
+            by_folder = Counter()
             
-            # Process each email
-            for email_id in email_ids:
-                try:
-                    # Get the email
-                    msg = imap.get_email(email_id)
-                    if not msg:
-                        logger.error(f"Failed to fetch email {email_id}")
+            q_in = queue.Queue(maxsize=QUEUE_SIZE)
+            q_out = queue.Queue()
+            with ThreadPoolExecutor(max_workers=NUM_PARALLEL + 1) as pool:
+                pool.submit(
+                    _fetch_emails, imap, email_ids, args.today_only,
+                    max(args.batch_size, 1), cache, q_in, q_out,
+                    NUM_PARALLEL
+                )
+                for _ in range(NUM_PARALLEL):
+                    pool.submit(_query_worker, q_in, q_out, cache)
+                
+                # Apply decisions as they come in
+                for _ in range(len(email_ids)):
+                    email_id, decision, error = q_out.get()
+                    if error:
+                        logger.error(
+                            f"Error processing email {email_id}: {error}"
+                        )
                         results["errors"] += 1
                         continue
+                    if decision is None:
+                        continue
                     
-                    # Check if we should process only today's emails
-                    if args.today_only:
-                        date_hdr = msg.get('Date')
-                        if not date_hdr:
-                            logger.info(
-                                f"Skipping email {email_id} (no date header)"
-                            )
-                            continue
-                        
-                        try:
-                            msg_dt = email.utils.parsedate_to_datetime(
-                                date_hdr
-                            )
-                            # Convert to local timezone if necessary
-                            if msg_dt.tzinfo is not None:
-                                today = datetime.now(msg_dt.tzinfo).date()
-                            else:
-                                today = datetime.today().date()
-                                
-                            if msg_dt.date() != today:
-                                logger.info(
-                                    f"Skipping email {email_id} "
-                                    f"(not from today)"
-                                )
-                                continue
-                        except Exception as e:
-                            logger.warning(
-                                f"Skipping email {email_id} "
-                                f"(date parsing error): {e}"
-                            )
-                            continue
-                        
-                    # Parse the email
-                    email_text = parse_email(msg)
-                    
-                    # Get decision from Ollama
-                    logger.info(f"Processing email {email_id}")
-                    decision = query_ollama(email_text)
-                    logger.info(f"AI Decision: {decision}")
-                    
-                    # Process the decision
-                    target_folder = process_email_decision(
-                        decision, email_id, imap, args.dry_run
-                    )
-                    
-                    results["processed"] += 1
-                    if target_folder:
-                        results["moved"] += 1
-                        results["by_folder"][target_folder] = (
-                            results["by_folder"].get(target_folder, 0) + 1
+                    try:
+                        target_folder = process_email_decision(
+                            decision, email_id, mover, args.dry_run
                         )
                         
-                except Exception as e:
-                    logger.error(f"Error processing email {email_id}: {e}")
-                    results["errors"] += 1
+                        results["processed"] += 1
+                        if target_folder:
+                            results["moved"] += 1
+                            by_folder[target_folder] += 1
+                            
+                    except Exception as e:
+                        logger.error(
+                            f"Error processing email {email_id}: {e}"
+                        )
+                        results["errors"] += 1
+            
+            # Remove the moved originals in one go
+            if results["moved"] and not args.dry_run:
+                mover.expunge()
             
             # Print summary
             logger.info("Processing complete!")
@@ -265,9 +671,9 @@ def process_imap_emails(args):
             logger.info(f"Moved: {results['moved']} emails")
             logger.info(f"Errors: {results['errors']} emails")
             
-            if results["by_folder"]:
+            if by_folder:
                 logger.info("Emails moved by folder:")
-                for folder, count in results["by_folder"].items():
+                for folder, count in by_folder.items():
                     logger.info(f"  - {folder}: {count} emails")
             
             return 0
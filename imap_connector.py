@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 
+import functools
 import imaplib
 import email
+import email.parser
+import email.policy
 import os
+import re
+import select
+import ssl
+import threading
+import time
 from dotenv import load_dotenv
 import logging
 
@@ -13,11 +21,257 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Start of one message's response, e.g. b'12 (RFC822 {3456}'
+_FETCH_START_RE = re.compile(rb'^\d+ \(')
+# UID data item anywhere in a FETCH response, e.g. b'(UID 4827 ...'
+_FETCH_UID_RE = re.compile(rb'[( ]UID (\d+)', re.IGNORECASE)
+# Name of the data item a literal belongs to, e.g. b'... BODY[1] {789}'
+_FETCH_ITEM_RE = re.compile(rb'(RFC822|BODY\[[^\]]*\](?:<\d+>)?) \{\d+\}$')
+# Literal size marker ending a response line, e.g. b'{789}'
+_LITERAL_SIZE_RE = re.compile(rb'\{\d+\}$')
+# One token of a parenthesized list: "(", ")", a quoted string or an atom
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+# LIST response, e.g. b'(\\HasNoChildren) "/" "My Folder"' (RFC 3501).
+# The delimiter may be NIL, and a name sent as a literal ends in {size}.
+_LIST_RE = re.compile(
+    rb'\((?P<flags>[^)]*)\)\s+(?:"(?P<delim>[^"]*)"|NIL)\s+'
+    rb'(?P<name>"(?:[^"\\]|\\.)*"|\S+)', re.IGNORECASE
+)
+# Backslash-escaped character inside a quoted string
+_QUOTED_CHAR_RE = re.compile(rb'\\(.)')
+# Untagged response announcing a new email, e.g. b'* 23 EXISTS'
+_EXISTS_RE = re.compile(rb'^\* \d+ EXISTS', re.IGNORECASE)
+
+# Servers may drop an IDLE connection after 30 minutes (RFC 2177)
+IDLE_TIMEOUT = 29 * 60
+
+# Only these header fields are fetched; the LLM doesn't need the rest,
+# and Message-ID keys the decision cache
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID"
+
+# Only the start of the text part is fetched; the LLM sees a few
+# thousand characters of it at most
+MAX_BODY_BYTES = 8192
+
+# Parses headers only, without building the MIME tree of the body
+_HEADER_PARSER = email.parser.BytesHeaderParser()
+# Parses the messages built from the fetched headers and text part
+_MESSAGE_PARSER = email.parser.BytesParser(policy=email.policy.default)
+
+
+def _split_fetch_response(data):
+    """
+    Split the data returned by a UID FETCH command into per-message items.
+    
+    Args:
+        data: The data list returned by imaplib's uid('FETCH', ...)
+        
+    Returns:
+        dict: Maps each message UID to a dict of the literals returned
+        for it, keyed by data item name (e.g. 'RFC822' or 'BODY[1]')
+    """
+    # Responses start with the sequence number; the UID item may come
+    # anywhere in them, even after the literals. Unsolicited responses,
+    # e.g. flag changes made over another connection, have no UID and
+    # are left out so a sequence number is never taken for a UID.
+    messages = []
+    for part in data:
+        head, literal = part if isinstance(part, tuple) else (part, None)
+        if not isinstance(head, bytes):
+            continue
+        if _FETCH_START_RE.match(head):
+            messages.append([None, {}])
+        if not messages:
+            continue
+        uid = _FETCH_UID_RE.search(head)
+        if uid:
+            messages[-1][0] = uid.group(1).decode()
+        item = _FETCH_ITEM_RE.search(head)
+        if literal is not None and item:
+            messages[-1][1][item.group(1).decode().upper()] = literal
+    return {uid: items for uid, items in messages if uid and items}
+
+
+def _join_fetch_response(data):
+    """
+    Rebuild each message's FETCH response as a single line, with any
+    literals inlined as quoted strings.
+    
+    Args:
+        data: The data list returned by imaplib's uid('FETCH', ...)
+        
+    Returns:
+        list: One response line per message, in the order received
+    """
+    lines = []
+    for part in data:
+        if isinstance(part, tuple):
+            head, literal = part
+            quoted = literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+            part = _LITERAL_SIZE_RE.sub(b'', head) + b'"' + quoted + b'"'
+        if not isinstance(part, bytes):
+            continue
+        if _FETCH_START_RE.match(part):
+            lines.append(part)
+        elif lines:
+            lines[-1] += part
+    return lines
+
+
+def _parse_imap_list(raw):
+    """
+    Parse an IMAP parenthesized list into nested Python lists.
+    
+    Args:
+        raw: The raw response bytes
+        
+    Returns:
+        list: The parsed tokens; strings are decoded and NIL becomes None
+    """
+    stack = [[]]
+    pos = 0
+    while True:
+        match = _TOKEN_RE.match(raw, pos)
+        if not match:
+            break
+        pos = match.end()
+        opening, closing, quoted, atom = match.groups()
+        if opening:
+            stack.append([])
+        elif closing:
+            if len(stack) > 1:
+                inner = stack.pop()
+                stack[-1].append(inner)
+        elif quoted is not None:
+            unescaped = _QUOTED_CHAR_RE.sub(rb'\1', quoted)
+            stack[-1].append(unescaped.decode(errors='replace'))
+        elif atom.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(atom.decode(errors='replace'))
+    return stack[0]
+
+
+def _get_fetch_attributes(line):
+    """
+    Parse the data items of a FETCH response line.
+    
+    Returns:
+        dict: Parsed values keyed by upper-cased item name, e.g. 'UID'
+        or 'BODYSTRUCTURE'
+    """
+    parsed = _parse_imap_list(line)
+    if len(parsed) < 2 or not isinstance(parsed[1], list):
+        return {}
+    attributes = parsed[1]
+    return {
+        name.upper(): value
+        for name, value in zip(attributes[::2], attributes[1::2])
+        if isinstance(name, str)
+    }
+
+
+def _find_text_part(structure, subtype="plain", section=""):
+    """
+    Find the first text part of a message with the given subtype.
+    
+    Args:
+        structure: The parsed BODYSTRUCTURE of the message
+        subtype: Text subtype to look for, e.g. "plain" or "html"
+        section: Section number of structure within the whole message
+        
+    Returns:
+        tuple: (section, subtype, charset, transfer encoding) of the part,
+        or None if the message has no such part
+    """
+    if not isinstance(structure, list) or not structure:
+        return None
+    
+    if isinstance(structure[0], list):
+        # Multipart: the child parts come first, then the subtype
+        for index, child in enumerate(structure, 1):
+            if not isinstance(child, list):
+                break
+            child_section = f"{section}.{index}" if section else str(index)
+            found = _find_text_part(child, subtype, child_section)
+            if found:
+                return found
+        return None
+    
+    if len(structure) < 6:
+        return None
+    media_type = f"{structure[0]}/{structure[1]}".lower()
+    if media_type != f"text/{subtype}":
+        return None
+    
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = None
+    for name, value in zip(params[::2], params[1::2]):
+        if str(name).lower() == "charset":
+            charset = value
+    # A single-part message's body is section 1
+    return section or "1", subtype, charset, structure[5] or "7bit"
+
+
+def _get_header_literal(items):
+    """Return the fetched header block from a message's FETCH items."""
+    return next(
+        (literal for name, literal in items.items()
+         if name.startswith('BODY[HEADER')),
+        b''
+    )
+
+
+def _build_message(items, text_part):
+    """
+    Build an email message from fetched header fields and text part.
+    
+    Args:
+        items: Literals fetched for the message, keyed by data item name
+        text_part: (section, subtype, charset, transfer encoding) of the
+            text part, or None if the message has none
+            
+    Returns:
+        email.message.Message: A single-part text message
+    """
+    headers = _get_header_literal(items)
+    lines = [headers.rstrip(b'\r\n')] if headers.strip() else []
+    body = b''
+    if text_part:
+        section, subtype, charset, encoding = text_part
+        lines.append(
+            f'Content-Type: text/{subtype}; '
+            f'charset="{charset or "us-ascii"}"'.encode()
+        )
+        lines.append(f'Content-Transfer-Encoding: {encoding}'.encode())
+        # A partial fetch comes back as e.g. BODY[1]<0>
+        body = items.get(f'BODY[{section}]<0>',
+                         items.get(f'BODY[{section}]', b''))
+    return _MESSAGE_PARSER.parsebytes(
+        b'\r\n'.join(lines) + b'\r\n\r\n' + body
+    )
+
+
+def _synchronized(method):
+    """
+    Run an IMAPConnector method while holding the connector's lock, since
+    an imaplib connection can only run one command at a time.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class IMAPConnector:
     """
     A class to connect to an IMAP server and perform email operations.
     Credentials are loaded from a .env file.
+    Safe to share between threads; their commands take turns on the
+    connection. Emails are addressed by UID, which unlike sequence
+    numbers stays the same when other emails are expunged.
     """
     
     def __init__(self, env_path='.env'):
@@ -41,7 +295,14 @@ class IMAPConnector:
         
         self.conn = None
         self.logged_in = False
+        self._has_move = False
+        self._has_idle = False
+        # Set by select_folder, when the server reports them
+        self.uid_validity = None
+        self.highest_modseq = None
+        self._lock = threading.RLock()
         
+    @_synchronized
     def connect(self):
         """
         Connect to the IMAP server and login.
@@ -56,6 +317,29 @@ class IMAPConnector:
             # Login to the server
             self.conn.login(self.username, self.password)
             self.logged_in = True
+            
+            # Capabilities can change after login, so query them now
+            status, data = self.conn.capability()
+            capabilities = data[0].upper().split() if status == 'OK' else []
+            self._has_move = b'MOVE' in capabilities
+            self._has_idle = b'IDLE' in capabilities
+            if capabilities:
+                # imaplib checks commands such as ENABLE against the
+                # capabilities it got before login
+                self.conn.capabilities = tuple(
+                    capability.decode() for capability in capabilities
+                )
+            
+            # Have SELECT report HIGHESTMODSEQ (CONDSTORE, RFC 7162)
+            if b'CONDSTORE' in capabilities and b'ENABLE' in capabilities:
+                try:
+                    status, data = self.conn.enable('CONDSTORE')
+                    if status != 'OK':
+                        logger.warning(
+                            f"Failed to enable CONDSTORE: {status}"
+                        )
+                except imaplib.IMAP4.error as e:
+                    logger.warning(f"Failed to enable CONDSTORE: {e}")
             logger.info(
                 f"Successfully connected to {self.server} as {self.username}"
             )
@@ -66,6 +350,7 @@ class IMAPConnector:
             self.logged_in = False
             return False
     
+    @_synchronized
     def disconnect(self):
         """
         Logout and disconnect from the IMAP server.
@@ -80,6 +365,7 @@ class IMAPConnector:
                 self.logged_in = False
                 self.conn = None
     
+    @_synchronized
     def list_folders(self):
         """
         List all available folders on the IMAP server.
@@ -97,14 +383,20 @@ class IMAPConnector:
                 # Parse the folder names
                 folder_list = []
                 for folder in folders:
-                    if isinstance(folder, bytes):
-                        folder_str = folder.decode('utf-8')
-                        # Extract the folder name from the response
-                        split_char = ' "/' if '"/' in folder_str else ' "'
-                        parts = folder_str.split(split_char)
-                        if len(parts) > 1:
-                            name = parts[-1].strip('"')
-                            folder_list.append(name)
+                    literal = None
+                    if isinstance(folder, tuple):
+                        folder, literal = folder
+                    if not isinstance(folder, bytes):
+                        continue
+                    match = _LIST_RE.match(folder)
+                    if not match:
+                        continue
+                    name = match.group('name')
+                    if literal is not None and _LITERAL_SIZE_RE.match(name):
+                        name = literal
+                    elif name.startswith(b'"'):
+                        name = _QUOTED_CHAR_RE.sub(rb'\1', name[1:-1])
+                    folder_list.append(name.decode('utf-8'))
                 
                 return folder_list
             else:
@@ -114,10 +406,14 @@ class IMAPConnector:
             logger.error(f"Error listing folders: {e}")
             return []
     
+    @_synchronized
     def select_folder(self, folder="INBOX"):
         """
         Select a specific folder on the IMAP server.
         
+        The folder's UIDVALIDITY and, if the server supports CONDSTORE,
+        HIGHESTMODSEQ are kept in uid_validity and highest_modseq.
+        
         Args:
             folder: The name of the folder to select
             
@@ -131,6 +427,11 @@ class IMAPConnector:
         try:
             status, data = self.conn.select(folder)
             if status == 'OK':
+                # SELECT always reports EXISTS; idle() should only see
+                # EXISTS responses for emails that arrive afterwards
+                self.conn.untagged_responses.pop('EXISTS', None)
+                self.uid_validity = self._response_number('UIDVALIDITY')
+                self.highest_modseq = self._response_number('HIGHESTMODSEQ')
                 logger.info(f"Selected folder: {folder}")
                 return True
             else:
@@ -140,6 +441,18 @@ class IMAPConnector:
             logger.error(f"Error selecting folder {folder}: {e}")
             return False
     
+    def _response_number(self, code):
+        """
+        Return the number sent with the last response code such as
+        UIDVALIDITY, or None if the server didn't send it.
+        """
+        _, data = self.conn.response(code)
+        try:
+            return int(data[-1])
+        except (TypeError, ValueError, IndexError):
+            return None
+    
+    @_synchronized
     def search_emails(self, criteria="ALL"):
         """
         Search for emails in the currently selected folder.
@@ -148,14 +461,14 @@ class IMAPConnector:
             criteria: The search criteria (default is "ALL")
             
         Returns:
-            list: A list of email IDs that match the criteria
+            list: A list of email UIDs that match the criteria
         """
         if not self.logged_in:
             logger.warning("Not connected to IMAP server")
             return []
         
         try:
-            status, data = self.conn.search(None, criteria)
+            status, data = self.conn.uid('SEARCH', None, criteria)
             if status == 'OK':
                 # Convert byte strings to integers
                 email_ids = data[0].split()
@@ -171,33 +484,168 @@ class IMAPConnector:
         """
         Fetch an email by its ID.
         
+        Only the From, Subject, Date and Message-ID headers and the first
+        MAX_BODY_BYTES of the first text/plain part (or text/html part, if
+        there is no plain text) are downloaded; attachments and other
+        parts are skipped.
+        
         Args:
             email_id: The ID of the email to fetch
             
         Returns:
-            email.message.Message: The email message object, or None if failed
+            email.message.Message: A single-part text message with the
+            fetched headers and text, or None if failed
+        """
+        return self.get_emails([email_id]).get(email_id)
+    
+    @_synchronized
+    def get_emails(self, email_ids):
+        """
+        Fetch several emails with as few FETCH commands as possible.
+        
+        The BODYSTRUCTURE of every email is fetched first to locate its
+        text part, then the header fields and text parts are fetched
+        with one command per distinct part number. Bodies are fetched with
+        BODY.PEEK, so emails are not marked as seen.
+        
+        Args:
+            email_ids: The IDs of the emails to fetch
+            
+        Returns:
+            dict: Single-part text messages keyed by email ID, as
+            returned by get_email. Emails that could not be fetched are
+            left out.
         """
         if not self.logged_in:
             logger.warning("Not connected to IMAP server")
-            return None
+            return {}
+        
+        if not email_ids:
+            return {}
         
+        message_set = ",".join(email_ids)
         try:
-            status, data = self.conn.fetch(email_id, '(RFC822)')
-            if status == 'OK':
-                raw_email = data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                return email_message
-            else:
-                logger.error(f"Failed to fetch email {email_id}: {status}")
-                return None
+            status, data = self.conn.uid(
+                'FETCH', message_set, '(BODYSTRUCTURE)'
+            )
+            if status != 'OK':
+                logger.error(
+                    f"Failed to fetch structure of emails {message_set}: "
+                    f"{status}"
+                )
+                return {}
+            
+            # Group the emails by the section holding their text
+            text_parts = {}
+            by_section = {}
+            requested = set(email_ids)
+            for line in _join_fetch_response(data):
+                attributes = _get_fetch_attributes(line)
+                email_id = attributes.get('UID')
+                if (email_id not in requested or
+                        'BODYSTRUCTURE' not in attributes):
+                    # Unsolicited response, e.g. a flag change, which
+                    # may carry a UID when CONDSTORE is enabled
+                    continue
+                structure = attributes.get('BODYSTRUCTURE')
+                text_part = (_find_text_part(structure) or
+                             _find_text_part(structure, "html"))
+                text_parts[email_id] = text_part
+                section = text_part[0] if text_part else None
+                by_section.setdefault(section, []).append(email_id)
+            
+            emails = {}
+            for section, ids in by_section.items():
+                items = f'BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})]'
+                if section:
+                    items += f' BODY.PEEK[{section}]<0.{MAX_BODY_BYTES}>'
+                status, data = self.conn.uid(
+                    'FETCH', ",".join(ids), f'({items})'
+                )
+                if status != 'OK':
+                    logger.error(
+                        f"Failed to fetch emails {','.join(ids)}: {status}"
+                    )
+                    continue
+                
+                for email_id, fetched in _split_fetch_response(data).items():
+                    if email_id not in requested:
+                        continue
+                    emails[email_id] = _build_message(
+                        fetched, text_parts.get(email_id)
+                    )
+            return emails
         except imaplib.IMAP4.error as e:
-            logger.error(f"Error fetching email {email_id}: {e}")
-            return None
+            logger.error(f"Error fetching emails {message_set}: {e}")
+            return {}
+    
+    def get_email_headers(self, email_id, fields=HEADER_FIELDS):
+        """
+        Fetch only some header fields of an email.
+        
+        Args:
+            email_id: The ID of the email to fetch
+            fields: Space-separated names of the header fields to fetch
+            
+        Returns:
+            email.message.Message: A message holding only the requested
+            headers, or None if failed
+        """
+        return self.get_emails_headers([email_id], fields).get(email_id)
+    
+    @_synchronized
+    def get_emails_headers(self, email_ids, fields=HEADER_FIELDS):
+        """
+        Fetch only some header fields of several emails with a single
+        FETCH command.
+        
+        Args:
+            email_ids: The IDs of the emails to fetch
+            fields: Space-separated names of the header fields to fetch
+            
+        Returns:
+            dict: Email message objects holding only the requested
+            headers, keyed by email ID. Emails that could not be fetched
+            are left out.
+        """
+        if not self.logged_in:
+            logger.warning("Not connected to IMAP server")
+            return {}
+        
+        if not email_ids:
+            return {}
+        
+        message_set = ",".join(email_ids)
+        try:
+            status, data = self.conn.uid(
+                'FETCH', message_set, f'(BODY.PEEK[HEADER.FIELDS ({fields})])'
+            )
+            if status != 'OK':
+                logger.error(
+                    f"Failed to fetch headers of emails {message_set}: "
+                    f"{status}"
+                )
+                return {}
+            
+            requested = set(email_ids)
+            return {
+                email_id: _HEADER_PARSER.parsebytes(_get_header_literal(items))
+                for email_id, items in _split_fetch_response(data).items()
+                if email_id in requested
+            }
+        except imaplib.IMAP4.error as e:
+            logger.error(f"Error fetching headers of {message_set}: {e}")
+            return {}
     
+    @_synchronized
     def move_email(self, email_id, destination_folder):
         """
         Move an email to another folder.
         
+        Uses the MOVE extension (RFC 6851) when the server supports it,
+        otherwise copies the email and marks the original as deleted. Call
+        expunge() once after a batch of moves to remove the originals.
+        
         Args:
             email_id: The ID of the email to move
             destination_folder: The folder to move the email to
@@ -210,8 +658,27 @@ class IMAPConnector:
             return False
         
         try:
+            if self._has_move:
+                status, data = self.conn.uid(
+                    'MOVE', email_id, destination_folder
+                )
+                if status != 'OK':
+                    logger.error(
+                        f"Failed to move email {email_id} to "
+                        f"{destination_folder}: {status}"
+                    )
+                    return False
+                
+                logger.info(
+                    f"Successfully moved email {email_id} to "
+                    f"{destination_folder}"
+                )
+                return True
+            
             # Copy the email to the destination folder
-            status, data = self.conn.copy(email_id, destination_folder)
+            status, data = self.conn.uid(
+                'COPY', email_id, destination_folder
+            )
             if status != 'OK':
                 logger.error(
                     f"Failed to copy email {email_id} to "
@@ -220,19 +687,15 @@ class IMAPConnector:
                 return False
             
             # Mark the original email as deleted
-            status, data = self.conn.store(email_id, '+FLAGS', r'(\Deleted)')
+            status, data = self.conn.uid(
+                'STORE', email_id, '+FLAGS', r'(\Deleted)'
+            )
             if status != 'OK':
                 logger.error(
                     f"Failed to mark email {email_id} as deleted: {status}"
                 )
                 return False
             
-            # Expunge to actually remove the email
-            status, data = self.conn.expunge()
-            if status != 'OK':
-                logger.error(f"Failed to expunge mailbox: {status}")
-                return False
-            
             logger.info(
                 f"Successfully moved email {email_id} to {destination_folder}"
             )
@@ -243,6 +706,218 @@ class IMAPConnector:
             )
             return False
 
+    @_synchronized
+    def move_emails(self, moves):
+        """
+        Move several emails, possibly to different folders, in one go.
+        
+        Uses one MOVE command per destination folder when the server
+        supports it. Otherwise the emails are copied with one COPY command
+        per folder, then all of them are marked as deleted with a single
+        STORE and removed with a single EXPUNGE.
+        
+        Args:
+            moves: (email UID, destination folder) pairs
+            
+        Returns:
+            list: The UIDs of the emails now in their destination folder.
+            If the originals could not be removed after copying, the
+            error is logged and the copied emails are still returned.
+        """
+        if not self.logged_in:
+            logger.warning("Not connected to IMAP server")
+            return []
+        
+        by_folder = {}
+        for email_id, destination_folder in moves:
+            by_folder.setdefault(destination_folder, []).append(email_id)
+        
+        command = 'MOVE' if self._has_move else 'COPY'
+        moved = []
+        try:
+            for destination_folder, ids in by_folder.items():
+                message_set = ",".join(ids)
+                status, data = self.conn.uid(
+                    command, message_set, destination_folder
+                )
+                if status != 'OK':
+                    logger.error(
+                        f"Failed to {command.lower()} emails {message_set} "
+                        f"to {destination_folder}: {status}"
+                    )
+                    continue
+                moved.extend(ids)
+        except imaplib.IMAP4.error as e:
+            logger.error(f"Error moving emails: {e}")
+            return moved
+        
+        if not moved or self._has_move:
+            logger.info(f"Successfully moved {len(moved)} emails")
+            return moved
+        
+        # The copies are made, so only the originals are left to remove
+        message_set = ",".join(moved)
+        try:
+            status, data = self.conn.uid(
+                'STORE', message_set, '+FLAGS', r'(\Deleted)'
+            )
+            if status != 'OK':
+                logger.error(
+                    f"Copied emails {message_set} but failed to mark the "
+                    f"originals as deleted: {status}"
+                )
+                return moved
+        except imaplib.IMAP4.error as e:
+            logger.error(
+                f"Copied emails {message_set} but failed to mark the "
+                f"originals as deleted: {e}"
+            )
+            return moved
+        
+        if not self.expunge():
+            logger.error(
+                f"Copied emails {message_set} but failed to expunge the "
+                f"originals"
+            )
+            return moved
+        
+        logger.info(f"Successfully moved {len(moved)} emails")
+        return moved
+
+    @_synchronized
+    def expunge(self):
+        """
+        Permanently remove the emails marked as deleted from the selected
+        folder.
+        
+        Returns:
+            bool: True if the folder was expunged successfully, False
+            otherwise
+        """
+        if not self.logged_in:
+            logger.warning("Not connected to IMAP server")
+            return False
+        
+        try:
+            status, data = self.conn.expunge()
+            if status != 'OK':
+                logger.error(f"Failed to expunge mailbox: {status}")
+                return False
+            return True
+        except imaplib.IMAP4.error as e:
+            logger.error(f"Error expunging mailbox: {e}")
+            return False
+
+    @_synchronized
+    def noop(self):
+        """
+        Send a NOOP command, which keeps an idle connection alive and lets
+        the server report new emails.
+        
+        Returns:
+            bool: True if the server answered, False otherwise
+        """
+        if not self.logged_in:
+            logger.warning("Not connected to IMAP server")
+            return False
+        
+        try:
+            status, data = self.conn.noop()
+            if status != 'OK':
+                logger.error(f"NOOP failed: {status}")
+                return False
+            return True
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.error(f"Error sending NOOP: {e}")
+            return False
+
+    @property
+    def supports_idle(self):
+        """Whether the server supports the IDLE command (RFC 2177)."""
+        return self.logged_in and self._has_idle
+
+    def _has_buffered_data(self):
+        """
+        Check, without blocking, whether data has been received but not
+        read yet. It may sit in imaplib's buffered reader or the SSL
+        layer, where select() can't see it.
+        """
+        sock = self.conn.socket()
+        blocking_timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(self.conn.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(blocking_timeout)
+    
+    @_synchronized
+    def idle(self, timeout=IDLE_TIMEOUT):
+        """
+        Wait until the server reports a new email in the selected folder,
+        using the IDLE command (RFC 2177) so nothing is sent meanwhile.
+        
+        Args:
+            timeout: Seconds after which to stop waiting; keep it under
+                30 minutes, after which servers may drop the connection
+                
+        Returns:
+            bool: True if IDLE ended normally, after a new email or the
+            timeout; False if it failed or the connection was lost
+        """
+        if not self.supports_idle:
+            logger.warning("IMAP server does not support IDLE")
+            return False
+        
+        # An email that arrived during earlier commands was already
+        # reported, so there is nothing to wait for
+        if self.conn.untagged_responses.pop('EXISTS', None):
+            return True
+        
+        try:
+            tag = self.conn._new_tag()
+            self.conn.send(tag + b' IDLE\r\n')
+            response = self.conn.readline()
+            if not response.startswith(b'+'):
+                logger.error(f"Failed to start IDLE: {response!r}")
+                return False
+            
+            # Wait for the socket to become readable rather than using a
+            # socket timeout, which would break imaplib's buffered reader
+            sock = self.conn.socket()
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if not self._has_buffered_data():
+                    if remaining <= 0:
+                        break
+                    readable, _, _ = select.select([sock], [], [], remaining)
+                    if not readable:
+                        break
+                line = self.conn.readline()
+                if not line:
+                    logger.error("Connection closed during IDLE")
+                    return False
+                if _EXISTS_RE.match(line):
+                    break
+            
+            # End IDLE and wait for its tagged completion
+            self.conn.send(b'DONE\r\n')
+            while True:
+                line = self.conn.readline()
+                if not line:
+                    logger.error("Connection closed while ending IDLE")
+                    return False
+                if line.startswith(tag + b' '):
+                    if line.split()[1].upper() != b'OK':
+                        logger.error(f"IDLE failed: {line!r}")
+                        return False
+                    return True
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.error(f"Error during IDLE: {e}")
+            return False
+
     def __enter__(self):
         """
         Context manager entry point.
@@ -274,4 +949,5 @@ if __name__ == "__main__":
             
             # Move the first email to another folder (if any emails exist)
             if email_ids:
-                imap.move_email(email_ids[0], "Archives")
\ No newline at end of file
+                imap.move_email(email_ids[0], "Archives")
+                imap.expunge()
\ No newline at end of file
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import argparse
+import itertools
 import logging
 import re
 import sys
@@ -22,6 +23,14 @@ AVAILABLE_FOLDERS = [
     "Trash"
 ]
 
+# Emails whose headers are fetched per FETCH command when filtering
+HEADER_BATCH_SIZE = 100
+
+# Characters that give a regex pattern special meaning. A "." is left
+# out: in addresses and domains it is meant literally, and the server
+# then matches it as a dot.
+_REGEX_SPECIAL_RE = re.compile(r"[\^$*+?{}\[\]\\|()]")
+
 
 def setup_argparser():
     """Setup the argument parser for command-line options."""
@@ -54,13 +63,17 @@ def setup_argparser():
     parser.add_argument(
         "--subject-match", 
         type=str,
-        help="Only move emails with subjects matching this regex pattern"
+        help="Only move emails with subjects matching this regex pattern; "
+             "plain text is matched by the server, case-insensitively, "
+             "with \".\" taken as a literal dot"
     )
     
     parser.add_argument(
         "--sender-match", 
         type=str,
-        help="Only move emails from senders matching this regex pattern"
+        help="Only move emails from senders matching this regex pattern; "
+             "plain text is matched by the server, case-insensitively, "
+             "with \".\" taken as a literal dot"
     )
     
     parser.add_argument(
@@ -86,53 +99,90 @@ def setup_argparser():
     return parser
 
 
+def _is_plain_text(pattern):
+    """Check whether a regex pattern only matches itself, literally."""
+    return pattern.isascii() and not _REGEX_SPECIAL_RE.search(pattern)
+
+
+def _imap_quote(text):
+    """Quote a string for use in IMAP SEARCH criteria."""
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
 def filter_emails_by_content(imap, email_ids, subject_pattern=None,
-                             sender_pattern=None, limit=10):
+                             sender_pattern=None, limit=10, criteria="ALL"):
     """
     Filter emails by content (subject and/or sender) using regex patterns.
     
+    Patterns without regex special characters are matched by the server
+    with a SEARCH command, so no emails need to be fetched for them. Note
+    that the server matches them case-insensitively. Only the Subject and
+    From headers of the remaining emails are fetched.
+    
     Args:
         imap: The IMAPConnector instance
         email_ids: List of email IDs to filter
         subject_pattern: Regex pattern to match against email subjects
         sender_pattern: Regex pattern to match against email senders
         limit: Maximum number of emails to return
+        criteria: The IMAP search criteria email_ids were found with
         
     Returns:
-        list: Filtered list of email IDs
+        list: (email ID, subject, sender) tuples of the matching emails
     """
-    if not subject_pattern and not sender_pattern:
-        return email_ids[:limit]
+    server_criteria = []
+    if subject_pattern and _is_plain_text(subject_pattern):
+        server_criteria.append(
+            f"HEADER Subject {_imap_quote(subject_pattern)}"
+        )
+        subject_pattern = None
+    if sender_pattern and _is_plain_text(sender_pattern):
+        server_criteria.append(f"FROM {_imap_quote(sender_pattern)}")
+        sender_pattern = None
+    if server_criteria:
+        email_ids = imap.search_emails(
+            f"({criteria} {' '.join(server_criteria)})"
+        )
     
     subject_regex = re.compile(subject_pattern) if subject_pattern else None
     sender_regex = re.compile(sender_pattern) if sender_pattern else None
     
-    filtered_ids = []
+    filtered = []
     
-    for email_id in email_ids:
-        if len(filtered_ids) >= limit:
+    # Fetch just the Subject and From headers, a batch at a time
+    ids = iter(email_ids)
+    while len(filtered) < limit:
+        batch = list(itertools.islice(ids, HEADER_BATCH_SIZE))
+        if not batch:
             break
             
-        msg = imap.get_email(email_id)
-        if not msg:
-            continue
-            
-        subject = msg.get("Subject", "")
-        sender = msg.get("From", "")
-        
-        subject_match = True
-        sender_match = True
-        
-        if subject_regex:
-            subject_match = bool(subject_regex.search(subject))
+        headers = imap.get_emails_headers(batch, "SUBJECT FROM")
+        for email_id in batch:
+            if len(filtered) >= limit:
+                break
+                
+            msg = headers.get(email_id)
+            if not msg:
+                continue
+                
+            subject = msg.get("Subject", "")
+            sender = msg.get("From", "")
             
-        if sender_regex:
-            sender_match = bool(sender_regex.search(sender))
+            subject_match = True
+            sender_match = True
             
-        if subject_match and sender_match:
-            filtered_ids.append(email_id)
+            if subject_regex:
+                subject_match = bool(subject_regex.search(subject))
+                
+            if sender_regex:
+                sender_match = bool(sender_regex.search(sender))
+                
+            if subject_match and sender_match:
+                filtered.append((
+                    email_id, subject or "(no subject)", sender or "(unknown)"
+                ))
             
-    return filtered_ids
+    return filtered
 
 
 def main():
@@ -162,42 +212,32 @@ def main():
                 return 0
                 
             # Filter emails by content if needed
-            filtered_ids = filter_emails_by_content(
+            filtered = filter_emails_by_content(
                 imap, 
                 email_ids, 
                 args.subject_match, 
                 args.sender_match, 
-                args.limit
+                args.limit,
+                args.search
             )
             
             logger.info(
-                f"Selected {len(filtered_ids)} emails to move to "
+                f"Selected {len(filtered)} emails to move to "
                 f"{args.destination}"
             )
             
             if args.dry_run:
                 logger.info("DRY RUN - No emails will be moved")
-                for email_id in filtered_ids:
-                    msg = imap.get_email(email_id)
-                    if msg:
-                        subject = msg.get("Subject", "(no subject)")
-                        sender = msg.get("From", "(unknown)")
-                        logger.info(
-                            f"Would move email {email_id}: "
-                            f"From: {sender}, Subject: {subject}"
-                        )
+                for email_id, subject, sender in filtered:
+                    logger.info(
+                        f"Would move email {email_id}: "
+                        f"From: {sender}, Subject: {subject}"
+                    )
                 return 0
                 
             # Move the filtered emails
             success_count = 0
-            for email_id in filtered_ids:
-                msg = imap.get_email(email_id)
-                if not msg:
-                    continue
-                    
-                subject = msg.get("Subject", "(no subject)")
-                sender = msg.get("From", "(unknown)")
-                
+            for email_id, subject, sender in filtered:
                 logger.info(
                     f"Moving email {email_id}: "
                     f"From: {sender}, Subject: {subject}"
@@ -205,10 +245,14 @@ def main():
                 
                 if imap.move_email(email_id, args.destination):
                     success_count += 1
-                    
+            
+            # Remove the moved originals in one go
+            if success_count:
+                imap.expunge()
+                
             logger.info(
                 f"Successfully moved {success_count} out of "
-                f"{len(filtered_ids)} emails"
+                f"{len(filtered)} emails"
             )
             
             return 0
@@ -1,11 +1,23 @@
 #!/usr/bin/env python
 
 import argparse
+import itertools
+import json
 import logging
+import os
+import queue
 import sys
-import re
-from imap_connector import IMAPConnector
-from flag import query_ollama, parse_email
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decision_cache import MessageIdCache, SemanticDecisionCache
+from imap_connector import IDLE_TIMEOUT, IMAPConnector
+from flag import (
+    NUM_PARALLEL, classify_batch, decide_folder, embed_text, open_cache,
+    parse_action, parse_email
+)
+import requests
 
 # Setup logging
 logging.basicConfig(
@@ -14,6 +26,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Emails fetched per FETCH command; larger batches gain little
+FETCH_BATCH_SIZE = 100
+# Batches fetched ahead of the one being classified
+PREFETCH_BATCHES = 2
+# Emails classified per Ollama request
+BATCH_SIZE = 8
+# Highest mod-sequence seen per folder, to search only changed emails
+MODSEQ_STATE_PATH = "modseq_state.json"
+# Seconds between polls in daemon mode
+POLL_INTERVAL = 60
+# Longest a daemon's connection is left idle before sending NOOP
+NOOP_INTERVAL = 5 * 60
+
 
 def setup_argparser():
     """Setup the argument parser for command-line options."""
@@ -41,6 +66,53 @@ def setup_argparser():
         help="Don't actually move emails, just show decisions"
     )
     
+    parser.add_argument(
+        "--fetch-batch-size", 
+        type=int, 
+        default=FETCH_BATCH_SIZE,
+        help="Number of emails fetched per IMAP FETCH command "
+             f"(default: {FETCH_BATCH_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--batch-size", 
+        type=int, 
+        default=BATCH_SIZE,
+        help="Number of emails classified per AI request "
+             f"(default: {BATCH_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--concurrency", 
+        type=int, 
+        default=NUM_PARALLEL,
+        help="Number of emails classified by the AI at the same time; "
+             "keep it within what the Ollama server can run in parallel "
+             f"(default: {NUM_PARALLEL})"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always ask the AI, even for emails seen or similar to "
+             "earlier ones"
+    )
+    
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and poll for new emails over the same "
+             "connection"
+    )
+    
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=POLL_INTERVAL,
+        help="Seconds between polls in daemon mode, if the server "
+             f"doesn't support IDLE (default: {POLL_INTERVAL})"
+    )
+    
     parser.add_argument(
         "--env-file", 
         type=str, 
@@ -51,56 +123,312 @@ def setup_argparser():
     return parser
 
 
-def process_email_action(decision, email_id, imap_connector, dry_run=False):
+def fetch_emails_in_batches(imap, email_ids, batch_size=FETCH_BATCH_SIZE):
+    """
+    Fetch emails a batch at a time instead of one FETCH per email.
+    
+    Args:
+        imap: The IMAPConnector instance
+        email_ids: List of email IDs to fetch
+        batch_size: Number of emails fetched per FETCH command
+        
+    Yields:
+        list: (email ID, message) tuples for one batch of IDs, in order;
+        the message is None if the email could not be fetched
+    """
+    ids = iter(email_ids)
+    while True:
+        batch = list(itertools.islice(ids, max(batch_size, 1)))
+        if not batch:
+            return
+        messages = imap.get_emails(batch)
+        yield [(email_id, messages.get(email_id)) for email_id in batch]
+
+
+def prefetch(items, size=PREFETCH_BATCHES):
+    """
+    Produce items from a background thread, up to size ahead of the
+    consumer, so fetching overlaps with classifying.
+    
+    Args:
+        items: Iterable producing the items, e.g. fetched batches
+        size: Maximum number of items produced ahead
+        
+    Yields:
+        The items, in order. An exception raised while producing them
+        is re-raised in the consumer.
+    """
+    done = object()
+    buffer = queue.Queue(maxsize=max(size, 1))
+    
+    def produce():
+        try:
+            for item in items:
+                buffer.put((item, None))
+            buffer.put((done, None))
+        except Exception as e:
+            buffer.put((done, e))
+    
+    # A daemon thread doesn't keep the program alive if the consumer
+    # gives up early
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = buffer.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+def classify_emails(items, cache=None, seen=None):
     """
-    Process the decision from AI and take appropriate action.
+    Ask the AI which folders a group of emails belong in, with a single
+    request for all the short emails that aren't cached. Runs in a
+    worker thread.
     
     Args:
-        decision: Decision text from the AI
-        email_id: Email ID to act upon
-        imap_connector: IMAPConnector instance
-        dry_run: If True, don't actually move emails
+        items: List of (email ID, message) tuples
+        cache: SemanticDecisionCache to reuse decisions from, or None
+        seen: MessageIdCache of decisions by Message-ID, or None
         
     Returns:
-        str: The folder the email was moved to, or None if not moved
+        list: (email ID, target folder, error) tuples; the target folder
+        is None if the email should stay put or could not be classified
     """
-    action_match = re.search(r"Action:\s*(\w+)", decision)
-    if not action_match:
-        logger.warning(f"Could not parse action from decision: {decision}")
-        return None
+    results = []
+    pending = []
+    message_ids = {}
+    for email_id, msg in items:
+        message_id = str(msg.get("Message-ID") or "").strip()
+        decision = seen.get(message_id) if seen is not None else None
+        # Empty or garbled decisions stored by older versions are misses
+        if parse_action(decision):
+            logger.info(f"Known decision for email {email_id}: {decision}")
+            results.append((email_id, decide_folder(decision), None))
+            continue
         
-    action = action_match.group(1).lower()
-    
-    # Determine target folder based on action
-    target_folder = None
-    
-    if action == "archive":
-        target_folder = "Archives"
-    elif action == "flag":
-        if "newsletter" in decision.lower():
-            target_folder = "Newsletters"
-        else:
-            target_folder = "INBOX/Important"
-    elif action == "spam" or "spam" in decision.lower():
-        target_folder = "Spam"
-    elif action == "trash" or "trash" in decision.lower():
-        target_folder = "Trash"
+        email_text = parse_email(msg)
+        if cache is not None:
+            try:
+                decision = cache.get(email_text)
+            except requests.RequestException as e:
+                logger.warning(f"Semantic cache unavailable: {e}")
+                cache = None
+        if parse_action(decision):
+            logger.info(f"Cached decision for email {email_id}: {decision}")
+            if seen is not None:
+                seen.set(message_id, decision)
+            results.append((email_id, decide_folder(decision), None))
+            continue
+        pending.append((email_id, email_text))
+        message_ids[email_id] = message_id
+    
+    for (email_id, email_text), (_, decision, error) in zip(
+        pending, classify_batch(pending)
+    ):
+        if error:
+            results.append((email_id, None, error))
+            continue
+        if cache is not None:
+            try:
+                cache.set(email_text, decision)
+            except requests.RequestException as e:
+                logger.warning(f"Semantic cache unavailable: {e}")
+                cache = None
+        if seen is not None:
+            seen.set(message_ids[email_id], decision)
+        results.append((email_id, decide_folder(decision), None))
+    return results
+
+
+def load_modseqs(path=MODSEQ_STATE_PATH):
+    """
+    Load the mod-sequences saved by earlier runs.
+    
+    Returns:
+        dict: {"modseq": ..., "uidvalidity": ...} keyed by account and
+        folder; empty if nothing was saved yet
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {path}: {e}")
+        return {}
+
+
+def save_modseqs(modseqs, path=MODSEQ_STATE_PATH):
+    """Save the mod-sequences for the next run."""
+    with open(path, "w") as f:
+        json.dump(modseqs, f, indent=2)
+
+
+def _remember_modseq(imap, args, modseqs, key, modseq):
+    """Record that every unread email up to modseq has been handled."""
+    if modseqs is None or modseq is None or args.dry_run:
+        return
+    modseqs[key] = {"modseq": modseq, "uidvalidity": imap.uid_validity}
+
+
+def process_unread_emails(imap, args, cache=None, seen=None, modseqs=None):
+    """
+    Classify the unread emails in args.folder and move them.
+    
+    If the server supports CONDSTORE and an earlier run handled every
+    unread email, only emails changed since then are searched for.
+    
+    Args:
+        imap: The IMAPConnector instance
+        args: The parsed command-line arguments
+        cache: SemanticDecisionCache to reuse decisions from, or None
+        seen: MessageIdCache of decisions by Message-ID, or None
+        modseqs: Mod-sequences from load_modseqs, updated in place, or
+            None to always search the whole folder
+        
+    Returns:
+        int: 0 on success, 1 if the folder could not be selected
+    """
+    # Select the source folder
+    if not imap.select_folder(args.folder):
+        logger.error(f"Failed to select folder: {args.folder}")
+        return 1
         
-    if not target_folder:
-        logger.info(f"No folder change needed for action: {action}")
-        return None
+    key = f"{imap.username}@{imap.server}/{args.folder}"
+    known = modseqs.get(key) if modseqs is not None else None
+    modseq = imap.highest_modseq
+    criteria = 'UNSEEN'
+    if (known and modseq is not None and
+            known.get("uidvalidity") == imap.uid_validity):
+        if modseq <= known["modseq"]:
+            logger.info(f"No changes in {args.folder} since the last run")
+            return 0
+        criteria = f"MODSEQ {known['modseq'] + 1} UNSEEN"
         
-    if dry_run:
-        logger.info(f"Would move email {email_id} to {target_folder}")
-        return target_folder
+    # Search for unread emails (you can change this criteria)
+    email_ids = imap.search_emails(criteria)
+    logger.info(f"Found {len(email_ids)} unread emails in {args.folder}")
+    
+    # Emails beyond the limit are left for the next run
+    complete = len(email_ids) <= args.limit
+    email_ids = email_ids[:args.limit]
+    
+    if not email_ids:
+        logger.info("No emails to process")
+        _remember_modseq(imap, args, modseqs, key, modseq)
+        return 0
         
-    # Actually move the email
-    if imap_connector.move_email(email_id, target_folder):
-        logger.info(f"Moved email {email_id} to {target_folder}")
-        return target_folder
+    results = Counter()
+    by_folder = Counter()
+    moves = []
+    
+    # The next batches are fetched while the AI classifies one
+    batches = prefetch(fetch_emails_in_batches(
+        imap, email_ids, args.fetch_batch_size
+    ))
+    with ThreadPoolExecutor(max(args.concurrency, 1)) as pool:
+        for batch in batches:
+            fetched = []
+            for email_id, msg in batch:
+                if not msg:
+                    logger.error(f"Failed to fetch email {email_id}")
+                    results["errors"] += 1
+                    continue
+                fetched.append((email_id, msg))
+            
+            # Each worker classifies a group of emails at once
+            groups = iter(fetched)
+            futures = []
+            while True:
+                group = list(itertools.islice(groups, max(args.batch_size, 1)))
+                if not group:
+                    break
+                futures.append((group, pool.submit(
+                    classify_emails, group, cache, seen
+                )))
+            
+            # Queue the moves; all moves are made at the end
+            for group, future in futures:
+                try:
+                    classified = future.result()
+                except Exception as e:
+                    classified = [
+                        (email_id, None, e) for email_id, _ in group
+                    ]
+                for email_id, target_folder, error in classified:
+                    if error:
+                        logger.error(
+                            f"Error processing email {email_id}: {error}"
+                        )
+                        results["errors"] += 1
+                        continue
+                    results["processed"] += 1
+                    if target_folder:
+                        moves.append((email_id, target_folder))
+    
+    if args.dry_run:
+        for email_id, target_folder in moves:
+            logger.info(f"Would move email {email_id} to {target_folder}")
+        moved = {email_id for email_id, _ in moves}
     else:
-        logger.error(f"Failed to move email {email_id} to {target_folder}")
-        return None
+        moved = set(imap.move_emails(moves))
+        
+    for email_id, target_folder in moves:
+        if email_id not in moved:
+            logger.error(
+                f"Failed to move email {email_id} to {target_folder}"
+            )
+            results["errors"] += 1
+            continue
+        results["moved"] += 1
+        by_folder[target_folder] += 1
+    
+    # Emails that failed are retried by the next full search
+    if complete and not results["errors"]:
+        _remember_modseq(imap, args, modseqs, key, modseq)
+    
+    # Print summary
+    logger.info("Processing complete!")
+    logger.info(f"Processed: {results['processed']} emails")
+    logger.info(f"Moved: {results['moved']} emails")
+    logger.info(f"Errors: {results['errors']} emails")
+    
+    if by_folder:
+        logger.info("Emails moved by folder:")
+        for folder, count in by_folder.items():
+            logger.info(f"  - {folder}: {count} emails")
+    
+    return 0
+
+
+def wait_for_next_poll(imap, interval):
+    """
+    Wait until the next poll. If the server supports IDLE, wait for it to
+    report a new email instead, for at most IDLE_TIMEOUT seconds.
+    Otherwise sleep, sending NOOP whenever the connection has been idle
+    for NOOP_INTERVAL seconds so the server doesn't drop it.
+    
+    Args:
+        imap: The IMAPConnector instance
+        interval: Seconds to wait when IDLE is not supported
+        
+    Returns:
+        bool: True when it is time to poll, False if the connection was
+        lost
+    """
+    if imap.supports_idle:
+        return imap.idle(IDLE_TIMEOUT)
+    
+    deadline = time.monotonic() + interval
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, NOOP_INTERVAL))
+        if time.monotonic() < deadline and not imap.noop():
+            return False
 
 
 def main():
@@ -109,87 +437,50 @@ def main():
     args = parser.parse_args()
     
     try:
-        with IMAPConnector(env_path=args.env_file) as imap:
+        semantic_cache = open_cache(
+            args, SemanticDecisionCache, embed=embed_text
+        )
+        with semantic_cache as cache, \
+                open_cache(args, MessageIdCache) as seen, \
+                IMAPConnector(env_path=args.env_file) as imap:
             if not imap.logged_in:
                 logger.error("Failed to connect to IMAP server")
                 return 1
                 
-            # Select the source folder
-            if not imap.select_folder(args.folder):
-                logger.error(f"Failed to select folder: {args.folder}")
-                return 1
-                
-            # Search for unread emails (you can change this criteria)
-            email_ids = imap.search_emails('UNSEEN')
-            logger.info(
-                f"Found {len(email_ids)} unread emails in {args.folder}"
-            )
-            
-            # Limit the number of emails to process
-            email_ids = email_ids[:args.limit]
-            
-            if not email_ids:
-                logger.info("No emails to process")
-                return 0
+            modseqs = load_modseqs()
+            if not args.daemon:
+                status = process_unread_emails(
+                    imap, args, cache, seen, modseqs
+                )
+                if not args.dry_run:
+                    save_modseqs(modseqs)
+                return status
                 
-            results = {
-                "processed": 0,
-                "moved": 0,
-                "errors": 0,
-                "by_folder": {}
-            }
-            
-            # Process each email
-            for email_id in email_ids:
-                try:
-                    # Get the email
-                    msg = imap.get_email(email_id)
-                    if not msg:
-                        logger.error(f"Failed to fetch email {email_id}")
-                        results["errors"] += 1
-                        continue
-                        
-                    # Parse the email
-                    email_text = parse_email(msg)
-                    
-                    # Get decision from AI
-                    logger.info(f"Processing email {email_id}")
-                    decision = query_ollama(email_text)
-                    logger.info(f"AI Decision: {decision}")
-                    
-                    # Process the decision
-                    target_folder = process_email_action(
-                        decision, email_id, imap, args.dry_run
-                    )
-                    
-                    results["processed"] += 1
-                    if target_folder:
-                        results["moved"] += 1
-                        results["by_folder"][target_folder] = (
-                            results["by_folder"].get(target_folder, 0) + 1
-                        )
-                        
-                except Exception as e:
-                    logger.error(f"Error processing email {email_id}: {e}")
-                    results["errors"] += 1
-            
-            # Print summary
-            logger.info("Processing complete!")
-            logger.info(f"Processed: {results['processed']} emails")
-            logger.info(f"Moved: {results['moved']} emails")
-            logger.info(f"Errors: {results['errors']} emails")
-            
-            if results["by_folder"]:
-                logger.info("Emails moved by folder:")
-                for folder, count in results["by_folder"].items():
-                    logger.info(f"  - {folder}: {count} emails")
-            
-            return 0
+            # Reuse the same logged-in connection for every poll
+            if imap.supports_idle:
+                logger.info(f"Waiting for new emails in {args.folder}")
+            else:
+                logger.info(
+                    f"Polling {args.folder} every {args.interval} seconds"
+                )
+            while True:
+                if process_unread_emails(imap, args, cache, seen, modseqs):
+                    return 1
+                if not args.dry_run:
+                    save_modseqs(modseqs)
+                if seen is not None:
+                    seen.flush()
+                if not wait_for_next_poll(imap, args.interval):
+                    logger.error("Lost connection to IMAP server")
+                    return 1
             
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+        return 0
     except Exception as e:
         logger.exception(f"An error occurred: {e}")
         return 1
 
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
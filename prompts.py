@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# Prompts shared by every Ollama request. SYSTEM_PROMPT is always sent
+# first and byte-for-byte unchanged, so Ollama can reuse the cached
+# prefix between emails.
+
+# Define your criteria as part of the system prompt
+SYSTEM_PROMPT = """
+You are an assistant that helps manage emails. Based on the content of the
+email and the user's rules, decide whether to "archive" it or mark it as
+"important", "newsletter", "spam" or "trash".
+Return your decision as a JSON object of the form:
+{"action": "<archive|important|newsletter|spam|trash>",
+"reason": "<brief reason>"}
+User rules:
+- Archive notifications in 'Archives' folder unless urgent
+- If there's a direct question move the email to 'INBOX/Important'
+- Move emails that seem personal or urgent to 'INBOX/Important'
+- Flag newsletters by moving them to 'Newsletters' folder
+"""
+
+# Rough token count (~4 characters per token), used to pin the prefix
+SYSTEM_PROMPT_TOKEN_COUNT = len(SYSTEM_PROMPT) // 4
+
+# Actions the model may choose, each mapping to a folder
+ACTIONS = ["archive", "important", "newsletter", "spam", "trash"]
+
+# JSON schemas passed as Ollama's "format" to constrain the output
+DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ACTIONS},
+        "reason": {"type": "string"}
+    },
+    "required": ["action"]
+}
+BATCH_DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "decisions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    **DECISION_SCHEMA["properties"]
+                },
+                "required": ["id", "action"]
+            }
+        }
+    },
+    "required": ["decisions"]
+}
+
+# Appended after the emails when several are classified in one request
+BATCH_INSTRUCTIONS = """
+Each email above starts with its ID in square brackets. Decide on every
+email and return a JSON object of the form:
+{"decisions": [{"id": "<email id>", "action": "<action>",
+"reason": "<brief reason>"}, ...]}
+"""
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from decision_cache import (
+    DecisionCache, MessageIdCache, SemanticDecisionCache, normalize
+)
+
+
+class TestDecisionCache(unittest.TestCase):
+    """Test cases for the DecisionCache class."""
+
+    def setUp(self):
+        """Set up an in-memory cache."""
+        self.cache = DecisionCache(
+            model="test-model", system_prompt="Prompt", path=":memory:"
+        )
+
+    def tearDown(self):
+        """Close the cache."""
+        self.cache.close()
+
+    def test_normalize(self):
+        """Test that quoted replies and extra whitespace are ignored."""
+        self.assertEqual(
+            normalize("Hello   there\n\n> quoted reply\n  bye  \n"),
+            "Hello there bye"
+        )
+        self.assertEqual(
+            normalize("Thanks\n\nOn Mon, Bob wrote:\nold thread\n"),
+            "Thanks"
+        )
+
+    def test_get_and_set(self):
+        """Test storing and retrieving a decision."""
+        self.assertIsNone(self.cache.get("Subject: Hi\n\nBody"))
+
+        self.cache.set("Subject: Hi\n\nBody", "Action: archive.")
+
+        self.assertEqual(
+            self.cache.get("Subject: Hi\n\nBody  \n"), "Action: archive."
+        )
+        self.assertIsNone(self.cache.get("Subject: Hi\n\nOther body"))
+
+    def test_key_depends_on_model_and_prompt(self):
+        """Test that changing the model or prompt changes the key."""
+        other_model = DecisionCache(
+            model="other-model", system_prompt="Prompt", path=":memory:"
+        )
+        other_prompt = DecisionCache(
+            model="test-model", system_prompt="Other", path=":memory:"
+        )
+
+        key = self.cache.key("Body")
+
+        self.assertNotEqual(key, other_model.key("Body"))
+        self.assertNotEqual(key, other_prompt.key("Body"))
+        other_model.close()
+        other_prompt.close()
+
+    def test_expired_entries_are_ignored(self):
+        """Test that decisions older than the TTL are not returned."""
+        with patch('decision_cache.time.time', return_value=1000):
+            self.cache.set("Body", "Action: spam.")
+
+        with patch('decision_cache.time.time',
+                   return_value=1000 + self.cache.ttl + 1):
+            self.assertIsNone(self.cache.get("Body"))
+
+
+class TestMessageIdCache(unittest.TestCase):
+    """Test cases for the MessageIdCache class."""
+
+    def setUp(self):
+        """Set up an in-memory cache."""
+        self.cache = MessageIdCache(
+            model="test-model", system_prompt="Prompt", path=":memory:"
+        )
+
+    def tearDown(self):
+        """Close the cache."""
+        self.cache.close()
+
+    def test_get_and_set(self):
+        """Test that decisions are found before and after flushing."""
+        self.assertIsNone(self.cache.get("<a@example.com>"))
+
+        self.cache.set("<a@example.com>", "Action: archive.")
+        self.assertEqual(self.cache.get("<a@example.com>"), "Action: archive.")
+
+        self.cache.flush()
+        self.assertEqual(self.cache.get("<a@example.com>"), "Action: archive.")
+        self.assertIsNone(self.cache.get("<b@example.com>"))
+
+    def test_missing_message_id_is_not_cached(self):
+        """Test that emails without a Message-ID are never cached."""
+        self.cache.set("", "Action: spam.")
+        self.cache.flush()
+
+        self.assertIsNone(self.cache.get(""))
+
+    def test_other_prompt_is_a_miss(self):
+        """Test that decisions made with another prompt are not reused."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "decision_cache.db")
+            with MessageIdCache(model="test-model", system_prompt="Prompt",
+                                path=path) as cache:
+                cache.set("<a@example.com>", "Action: archive.")
+
+            with MessageIdCache(model="test-model", system_prompt="Other",
+                                path=path) as cache:
+                self.assertIsNone(cache.get("<a@example.com>"))
+            with MessageIdCache(model="test-model", system_prompt="Prompt",
+                                path=path) as cache:
+                self.assertEqual(cache.get("<a@example.com>"),
+                                 "Action: archive.")
+
+
+def fake_embed(text):
+    """Embed a text as its counts of a few marker words."""
+    return [text.count(word) for word in ("sale", "invoice", "meeting")]
+
+
+class TestSemanticDecisionCache(unittest.TestCase):
+    """Test cases for the SemanticDecisionCache class."""
+
+    def setUp(self):
+        """Set up an in-memory cache."""
+        self.cache = SemanticDecisionCache(
+            model="test-model", system_prompt="Prompt", embed=fake_embed,
+            path=":memory:"
+        )
+
+    def tearDown(self):
+        """Close the cache."""
+        self.cache.close()
+
+    def test_similar_emails_share_decisions(self):
+        """Test that only similar enough emails hit the cache."""
+        self.cache.set("Big sale! sale sale", "Action: newsletter.")
+
+        self.assertEqual(
+            self.cache.get("Another sale, sale today"), "Action: newsletter."
+        )
+        self.assertIsNone(self.cache.get("Your invoice for the meeting"))
+
+    def test_embeddings_are_stored_as_int8(self):
+        """Test that each stored vector takes one byte per dimension."""
+        self.cache.set("sale invoice", "Action: archive.")
+
+        blob, = self.cache.conn.execute(
+            "SELECT embedding FROM semantic_cache"
+        ).fetchone()
+
+        self.assertEqual(len(blob), 3)
+
+    def test_expired_entries_are_ignored(self):
+        """Test that decisions older than the TTL are not returned."""
+        with patch('decision_cache.time.time', return_value=1000):
+            self.cache.set("sale", "Action: newsletter.")
+
+        with patch('decision_cache.time.time',
+                   return_value=1000 + self.cache.ttl + 1):
+            self.assertIsNone(self.cache.get("sale"))
+
+    def test_expired_entries_are_dropped(self):
+        """Test that storing a decision drops the expired ones."""
+        with patch('decision_cache.time.time', return_value=1000):
+            self.cache.set("sale", "Action: newsletter.")
+
+        with patch('decision_cache.time.time',
+                   return_value=1000 + self.cache.ttl + 1):
+            self.cache.set("invoice", "Action: archive.")
+
+        self.assertEqual(len(self.cache._entries), 1)
+        count, = self.cache.conn.execute(
+            "SELECT COUNT(*) FROM semantic_cache"
+        ).fetchone()
+        self.assertEqual(count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,20 @@
 #!/usr/bin/env python
 
+import email
+import email.utils
+import json
+import queue
+import threading
 import unittest
-from flag import process_email_decision
+from datetime import date, datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from unittest.mock import MagicMock, patch
+from flag import (
+    _fetch_emails, _query_worker, classify_batch, imap_date, is_from_today,
+    parse_email, process_email_decision, process_imap_emails, query_ollama,
+    query_ollama_batch, setup_argparser
+)
 
 
 class TestFlagFunctions(unittest.TestCase):
@@ -21,39 +34,43 @@ class TestFlagFunctions(unittest.TestCase):
         # Create test cases
         test_cases = [
             {
-                "decision": "Action: archive. Reason: This is a notification.",
+                "decision": '{"action": "archive", '
+                            '"reason": "This is a notification."}',
                 "expected_folder": "Archives"
             },
             {
-                "decision": "Action: important. "
-                            "Reason: Contains direct questions.",
+                "decision": '{"action": "important", '
+                            '"reason": "Contains direct questions."}',
                 "expected_folder": "INBOX/Important"
             },
             {
-                "decision": "Action: flag. "
-                            "Reason: This is an important message.",
-                "expected_folder": "INBOX/Important"
+                "decision": '{"action": "newsletter", "reason": "Weekly."}',
+                "expected_folder": "Newsletters"
             },
             {
-                "decision": "Action: newsletter. "
-                            "Reason: This is a newsletter.",
-                "expected_folder": "Newsletters"
+                "decision": '{"action": "spam"}',
+                "expected_folder": "Spam"
             },
             {
-                "decision": "Action: flag. "
-                            "Reason: This is a newsletter subscription.",
-                "expected_folder": "Newsletters"
+                "decision": '{"action": "trash"}',
+                "expected_folder": "Trash"
             },
             {
-                "decision": "Action: spam. Reason: This is spam.",
+                # No more guessing the folder from the reason
+                "decision": '{"action": "flag", '
+                            '"reason": "This is a newsletter subscription."}',
+                "expected_folder": None
+            },
+            {
+                "decision": '{"action": "Spam"}',
                 "expected_folder": "Spam"
             },
             {
-                "decision": "Action: trash. Reason: This is trash.",
-                "expected_folder": "Trash"
+                "decision": '{"reason": "No action given."}',
+                "expected_folder": None
             },
             {
-                "decision": "Invalid decision format",
+                "decision": "Action: archive. Reason: Not JSON.",
                 "expected_folder": None
             }
         ]
@@ -95,6 +112,255 @@ class TestFlagFunctions(unittest.TestCase):
             else:
                 self.assertNotIn(email_id, mock_imap.moved_emails)
 
+    @patch('flag._SESSION')
+    def test_query_ollama_stops_after_action(self, mock_session):
+        """Test that streaming stops once the action has been generated."""
+        tokens = ['{"', 'action', '":', ' "', 'news', 'letter', '",',
+                  ' "reason', '": "', 'Weekly', '"}']
+        response = mock_session.post.return_value
+        response.iter_lines.return_value = iter(
+            json.dumps({"response": token, "done": False}).encode()
+            for token in tokens
+        )
+        
+        decision = query_ollama("Subject: Weekly digest")
+        
+        self.assertEqual(json.loads(decision), {"action": "newsletter"})
+        self.assertTrue(mock_session.post.call_args.kwargs["stream"])
+        response.close.assert_called_once()
+        # Tokens after the action are never read
+        self.assertEqual(next(response.iter_lines.return_value), json.dumps(
+            {"response": " \"reason", "done": False}
+        ).encode())
+
+    @patch('flag._SESSION')
+    def test_query_ollama_errors(self, mock_session):
+        """Test that errors and answers without an action are raised."""
+        response = mock_session.post.return_value
+        for chunks in ([{"error": "model not found"}],
+                       [{"response": '{"reason": "?"}', "done": True}],
+                       []):
+            response.iter_lines.return_value = iter(
+                json.dumps(chunk).encode() for chunk in chunks
+            )
+            with self.assertRaises(ValueError):
+                query_ollama("Subject: Hi")
+
+    @patch('flag._SESSION')
+    def test_query_ollama_batch(self, mock_session):
+        """Test that one batched response is split into per-email decisions."""
+        mock_session.post.return_value.json.return_value = {
+            "response": json.dumps({"decisions": [
+                {"id": "1", "action": "archive", "reason": "Notification."},
+                {"id": 2, "action": "newsletter", "reason": "Newsletter."},
+                {"id": "3"}
+            ]})
+        }
+        
+        decisions = query_ollama_batch(
+            [("1", "first email"), ("2", "second email"), ("3", "third")]
+        )
+        
+        self.assertEqual(
+            {k: json.loads(v) for k, v in decisions.items()},
+            {
+                "1": {"action": "archive", "reason": "Notification."},
+                "2": {"action": "newsletter", "reason": "Newsletter."}
+            }
+        )
+        # Both emails are sent in a single request
+        mock_session.post.assert_called_once()
+        prompt = mock_session.post.call_args.kwargs["json"]["prompt"]
+        self.assertIn("[1] first email", prompt)
+        self.assertIn("[2] second email", prompt)
+
+    def test_parse_email(self):
+        """Test that the first text/plain part is decoded by its charset."""
+        msg = MIMEMultipart("alternative")
+        msg["From"] = "sender@example.com"
+        msg["Subject"] = "Caf\u00e9"
+        msg.attach(MIMEText("Caf\u00e9 au lait", "plain", "iso-8859-1"))
+        msg.attach(MIMEText("Second part", "plain", "utf-8"))
+        msg.attach(MIMEText("<p>HTML</p>", "html", "utf-8"))
+        
+        text = parse_email(msg)
+        
+        self.assertEqual(
+            text,
+            "From: sender@example.com\nSubject: Caf\u00e9\n\n"
+            "Caf\u00e9 au lait"
+        )
+
+    def test_parse_email_html_and_truncation(self):
+        """Test the HTML fallback and that long emails are truncated."""
+        msg = MIMEText(
+            "<style>p {color: red}</style><p>Big &amp; sale</p>"
+            + "<p>More</p>" * 1000,
+            "html"
+        )
+        msg["Subject"] = "Offer"
+        
+        text = parse_email(msg)
+        
+        self.assertTrue(text.startswith("From: \nSubject: Offer\n\n"))
+        self.assertIn("Big & sale", text)
+        self.assertNotIn("<p>", text)
+        self.assertNotIn("color", text)
+        self.assertTrue(text.endswith("\n...[truncated]"))
+        self.assertEqual(len(text), 2000 + len("\n...[truncated]"))
+
+    def test_parse_email_strips_quoted_replies(self):
+        """Test that quoted history and extra whitespace are dropped."""
+        msg = MIMEText(
+            "Sounds   good,\n> inline quote\nsee you then.\n\n\n\n"
+            "On Mon, 1 Jan 2024 at 10:00, Bob <bob@example.com>\n"
+            "wrote:\n> Shall we meet?\n> Bob",
+            "plain"
+        )
+        msg["Subject"] = "Re: Meeting"
+        
+        text = parse_email(msg)
+        
+        self.assertEqual(
+            text,
+            "From: \nSubject: Re: Meeting\n\nSounds good,\nsee you then."
+        )
+
+    def test_is_from_today(self):
+        """Test that dates are compared in the local timezone."""
+        now = datetime.now().astimezone()
+        today = now.date()
+        
+        def message(dt):
+            return email.message_from_string(
+                f"Date: {email.utils.format_datetime(dt)}\n\n"
+            )
+        
+        self.assertTrue(is_from_today(message(now), "1", today))
+        # The same instant, written in timezones far from ours
+        for hours in (-11, 12):
+            sender_tz = timezone(timedelta(hours=hours))
+            self.assertTrue(
+                is_from_today(message(now.astimezone(sender_tz)), "2", today)
+            )
+        self.assertFalse(
+            is_from_today(message(now - timedelta(days=2)), "3", today)
+        )
+        self.assertFalse(
+            is_from_today(email.message_from_string("\n"), "4", today)
+        )
+
+    def test_imap_date(self):
+        """Test formatting dates for IMAP SEARCH criteria."""
+        self.assertEqual(imap_date(date(2025, 5, 3)), "03-May-2025")
+        self.assertEqual(imap_date(date(2024, 12, 31)), "31-Dec-2024")
+
+    def test_unparseable_decisions_not_cached(self):
+        """Test that empty cached decisions are misses and never stored."""
+        imap = MagicMock()
+        imap.get_emails.return_value = {
+            '1': email.message_from_string("Subject: Hi\n\nHello")
+        }
+        cache = MagicMock()
+        cache.get.return_value = ''
+        q_in, q_out = queue.Queue(), queue.Queue()
+        
+        _fetch_emails(imap, ['1'], False, 8, cache, q_in, q_out, 1)
+        
+        self.assertTrue(q_out.empty())
+        batch = q_in.get_nowait()
+        self.assertEqual([email_id for email_id, _ in batch], ['1'])
+        
+        q_in = queue.Queue()
+        q_in.put(batch)
+        q_in.put(None)
+        with patch('flag.query_ollama', return_value='{"reason": "?"}'):
+            _query_worker(q_in, q_out, cache)
+        email_id, decision, error = q_out.get_nowait()
+        self.assertIsInstance(error, ValueError)
+        cache.set.assert_not_called()
+
+    @patch('flag.query_ollama', return_value='{"action": "archive"}')
+    @patch('flag.query_ollama_batch')
+    def test_classify_batch(self, mock_batch, mock_single):
+        """Test that long and skipped emails are asked about alone."""
+        mock_batch.return_value = {'1': '{"action": "spam"}'}
+        items = [('1', "Subject: Prize"), ('2', "Subject: Receipt"),
+                 ('3', "Subject: Report\n\n" + "word " * 400)]
+        
+        results = classify_batch(items)
+        
+        self.assertEqual(results, [
+            ('1', '{"action": "spam"}', None),
+            ('2', '{"action": "archive"}', None),
+            ('3', '{"action": "archive"}', None)
+        ])
+        batch = mock_batch.call_args.args[0]
+        self.assertEqual([email_id for email_id, _ in batch], ['1', '2'])
+        self.assertEqual(mock_single.call_count, 2)
+
+    @patch('flag.query_ollama', return_value='{"action": "archive"}')
+    @patch('flag.open_cache')
+    @patch('flag.IMAPConnector')
+    def test_process_imap_emails(self, mock_connector, mock_open_cache,
+                                 mock_query):
+        """Test the pipeline from search to moves and a single expunge."""
+        imap, mover = MagicMock(), MagicMock()
+        imap.__enter__.return_value = imap
+        mover.__enter__.return_value = mover
+        mock_connector.side_effect = [imap, mover]
+        
+        now = datetime.now().astimezone()
+        dates = {'1': now, '2': now - timedelta(days=2), '3': now}
+        imap.search_emails.return_value = ['1', '2', '3']
+        imap.get_emails_headers.return_value = {
+            email_id: email.message_from_string(
+                f"Date: {email.utils.format_datetime(dt)}\n\n"
+            )
+            for email_id, dt in dates.items()
+        }
+        imap.get_emails.return_value = {
+            '1': email.message_from_string("Subject: Receipt\n\nThanks"),
+            '3': email.message_from_string("Subject: Prize\n\nYou won")
+        }
+        cache = mock_open_cache.return_value.__enter__.return_value
+        cache.get.side_effect = lambda text: (
+            '{"action": "spam"}' if "Prize" in text else None
+        )
+        args = setup_argparser().parse_args(['--today-only'])
+        
+        self.assertEqual(process_imap_emails(args), 0)
+        
+        imap.get_emails.assert_called_once_with(['1', '3'])
+        mock_query.assert_called_once()
+        cache.set.assert_called_once()
+        self.assertEqual(sorted(mover.move_email.call_args_list), [
+            (('1', 'Archives'),), (('3', 'Spam'),)
+        ])
+        mover.expunge.assert_called_once()
+        imap.move_email.assert_not_called()
+
+    @patch('flag.IMAPConnector')
+    def test_process_imap_emails_fetch_error(self, mock_connector):
+        """Test that a failed batch fetch is reported instead of hanging."""
+        imap = MagicMock()
+        imap.search_emails.return_value = ['1', '2']
+        imap.get_emails.side_effect = OSError('Connection reset')
+        mock_connector.return_value.__enter__.return_value = imap
+        args = setup_argparser().parse_args(['--no-cache'])
+        
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(process_imap_emails(args)),
+            daemon=True
+        )
+        thread.start()
+        thread.join(timeout=5)
+        
+        self.assertFalse(thread.is_alive(), "process_imap_emails hung")
+        self.assertEqual(result, [0])
+        imap.move_email.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -21,6 +21,7 @@ class TestIMAPConnector(unittest.TestCase):
         """Set up test environment."""
         self.connector = IMAPConnector()
         self.connector.conn = MagicMock(spec=imaplib.IMAP4_SSL)
+        self.connector.conn.untagged_responses = {}
         self.connector.logged_in = True
 
     def test_initialization(self):
@@ -76,92 +77,398 @@ class TestIMAPConnector(unittest.TestCase):
         self.connector.conn.list.return_value = ('OK', [
             b'(\\HasNoChildren) "/" "INBOX"',
             b'(\\HasNoChildren) "/" "Archives"',
-            b'(\\HasNoChildren) "/" "Newsletters"'
+            b'(\\HasNoChildren) "/" "Newsletters"',
+            b'(\\HasNoChildren) "/" "My \\"Old\\" Mail"',
+            b'(\\HasChildren) "." Work'
         ])
         
         folders = self.connector.list_folders()
         
-        self.assertEqual(len(folders), 3)
+        self.assertEqual(len(folders), 5)
+        self.assertIn('My "Old" Mail', folders)
+        self.assertIn('Work', folders)
         self.assertIn('INBOX', folders)
         self.assertIn('Archives', folders)
         self.assertIn('Newsletters', folders)
         self.connector.conn.list.assert_called_once()
 
+    def test_list_folders_nil_delimiter_and_literal(self):
+        """Test listing folders with a NIL delimiter or a literal name."""
+        self.connector.conn.list.return_value = ('OK', [
+            b'(\\Noselect) NIL "Shared"',
+            (b'(\\HasNoChildren) "/" {7}', b'Old "A"'),
+            b'(\\HasNoChildren) NIL Flat'
+        ])
+        
+        folders = self.connector.list_folders()
+        
+        self.assertEqual(folders, ['Shared', 'Old "A"', 'Flat'])
+
     def test_select_folder(self):
         """Test selecting a folder."""
         self.connector.conn.select.return_value = ('OK', [b'1'])
+        self.connector.conn.untagged_responses = {'EXISTS': [b'1']}
+        responses = {
+            'UIDVALIDITY': [b'3857529045'],
+            'HIGHESTMODSEQ': [b'715194045007']
+        }
+        self.connector.conn.response.side_effect = lambda code: (
+            code, responses[code]
+        )
         
         result = self.connector.select_folder('INBOX')
         
         self.assertTrue(result)
         self.connector.conn.select.assert_called_once_with('INBOX')
+        self.assertEqual(self.connector.uid_validity, 3857529045)
+        self.assertEqual(self.connector.highest_modseq, 715194045007)
+        self.assertEqual(self.connector.conn.untagged_responses, {})
+
+    @patch('imaplib.IMAP4_SSL')
+    def test_connect_enables_condstore(self, mock_imap):
+        """Test enabling CONDSTORE when only advertised after login."""
+        mock_instance = mock_imap.return_value
+        mock_instance.capabilities = ('IMAP4REV1', 'AUTH=PLAIN')
+        mock_instance.capability.return_value = (
+            'OK', [b'IMAP4rev1 ENABLE CONDSTORE MOVE']
+        )
+        mock_instance.enable.return_value = ('OK', [b'CONDSTORE'])
+        
+        self.assertTrue(self.connector.connect())
+        
+        self.assertIn('ENABLE', mock_instance.capabilities)
+        mock_instance.enable.assert_called_once_with('CONDSTORE')
+        self.assertTrue(self.connector._has_move)
 
     def test_search_emails(self):
         """Test searching for emails."""
-        self.connector.conn.search.return_value = ('OK', [b'1 2 3'])
+        self.connector.conn.uid.return_value = ('OK', [b'1 2 3'])
         
         email_ids = self.connector.search_emails('SUBJECT "Test"')
         
         self.assertEqual(len(email_ids), 3)
         self.assertEqual(email_ids, ['1', '2', '3'])
-        self.connector.conn.search.assert_called_once_with(
-            None, 'SUBJECT "Test"'
+        self.connector.conn.uid.assert_called_once_with(
+            'SEARCH', None, 'SUBJECT "Test"'
         )
 
     def test_get_email(self):
         """Test fetching an email."""
         # Mock email data
-        email_data = b'''From: sender@example.com
+        headers = b'''From: sender@example.com
 Subject: Test Subject
 Date: Wed, 12 May 2025 08:00:00 +0200
 
-This is a test email.'''
+'''
+        body = b'This is a test email.'
         
-        self.connector.conn.fetch.return_value = ('OK', [(b'1', email_data)])
+        self.connector.conn.uid.side_effect = [
+            ('OK', [
+                b'1 (UID 1 BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") '
+                b'NIL NIL "7bit" 21 1 NIL NIL NIL NIL))'
+            ]),
+            ('OK', [
+                (b'1 (UID 1 BODY[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)]'
+                 b' {%d}' % len(headers), headers),
+                (b' BODY[1]<0> {%d}' % len(body), body),
+                b')'
+            ])
+        ]
         
         email_msg = self.connector.get_email('1')
         
         self.assertIsNotNone(email_msg)
         self.assertEqual(email_msg['Subject'], 'Test Subject')
         self.assertEqual(email_msg['From'], 'sender@example.com')
-        self.connector.conn.fetch.assert_called_once_with('1', '(RFC822)')
+        self.assertEqual(
+            email_msg.get_payload(decode=True), b'This is a test email.'
+        )
+        self.connector.conn.uid.assert_any_call(
+            'FETCH', '1', '(BODYSTRUCTURE)'
+        )
+        self.connector.conn.uid.assert_called_with(
+            'FETCH', '1',
+            '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)] '
+            'BODY.PEEK[1]<0.8192>)'
+        )
+
+    def test_get_emails(self):
+        """Test fetching only the text/plain part of several emails.
+
+        The responses start with sequence numbers, but the emails are keyed
+        by the UIDs they were asked for.
+        """
+        first = b'From: one@example.com\r\nSubject: First\r\n\r\n'
+        second = b'From: two@example.com\r\nSubject: Second\r\n\r\n'
+        text = b'Caf=C3=A9'
+        self.connector.conn.uid.side_effect = [
+            ('OK', [
+                b'1 (UID 41 BODYSTRUCTURE (("text" "plain" ("charset" '
+                b'"utf-8") NIL NIL "quoted-printable" 9 1)("text" "html" '
+                b'NIL NIL NIL "7bit" 20 1) "alternative"))',
+                b'3 (BODYSTRUCTURE ("image" "png" NIL NIL NIL "base64" 10) '
+                b'UID 43)'
+            ]),
+            ('OK', [
+                (b'1 (UID 41 BODY[HEADER.FIELDS (FROM SUBJECT DATE '
+                 b'MESSAGE-ID)] {%d}' % len(first), first),
+                (b' BODY[1]<0> {%d}' % len(text), text),
+                b')'
+            ]),
+            ('OK', [
+                (b'3 (BODY[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)] {%d}'
+                 % len(second), second),
+                b' UID 43)'
+            ])
+        ]
+        
+        emails = self.connector.get_emails(['41', '43'])
+        
+        self.assertEqual(sorted(emails), ['41', '43'])
+        self.assertEqual(emails['41']['Subject'], 'First')
+        self.assertEqual(
+            emails['41'].get_payload(decode=True).decode('utf-8'), 'Café'
+        )
+        self.assertEqual(emails['43']['From'], 'two@example.com')
+        self.assertEqual(emails['43'].get_payload(), '')
+        self.connector.conn.uid.assert_any_call(
+            'FETCH', '41',
+            '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)] '
+            'BODY.PEEK[1]<0.8192>)'
+        )
+        self.connector.conn.uid.assert_any_call(
+            'FETCH', '43',
+            '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)])'
+        )
+
+    def test_get_emails_headers(self):
+        """Test fetching only some header fields of several emails."""
+        first = b'Subject: First\r\nFrom: one@example.com\r\n\r\n'
+        second = b'Subject: Second\r\nFrom: two@example.com\r\n\r\n'
+        self.connector.conn.uid.return_value = ('OK', [
+            (b'1 (UID 1 BODY[HEADER.FIELDS (SUBJECT FROM)] {%d}' % len(first),
+             first), b')',
+            (b'2 (UID 2 BODY[HEADER.FIELDS (SUBJECT FROM)] {%d}'
+             % len(second), second), b')'
+        ])
+        
+        headers = self.connector.get_emails_headers(
+            ['1', '2'], "SUBJECT FROM"
+        )
+        
+        self.assertEqual(headers['1']['Subject'], 'First')
+        self.assertEqual(headers['2']['From'], 'two@example.com')
+        self.connector.conn.uid.assert_called_once_with(
+            'FETCH', '1,2', '(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM)])'
+        )
+
+    def test_get_emails_skips_unsolicited_fetch(self):
+        """Test that flag changes from other connections are ignored."""
+        headers = b'From: one@example.com\r\nSubject: First\r\n\r\n'
+        self.connector.conn.uid.side_effect = [
+            ('OK', [
+                b'7 (FLAGS (\\Seen \\Deleted))',
+                b'8 (UID 99 MODSEQ (12) FLAGS (\\Seen))',
+                b'1 (UID 41 BODYSTRUCTURE ("image" "png" NIL NIL NIL '
+                b'"base64" 10))',
+                b'1 (UID 41 MODSEQ (13) FLAGS (\\Seen))'
+            ]),
+            ('OK', [
+                b'7 (FLAGS (\\Seen \\Deleted))',
+                (b'1 (UID 41 BODY[HEADER.FIELDS (FROM SUBJECT DATE '
+                 b'MESSAGE-ID)] {%d}' % len(headers), headers),
+                b')'
+            ])
+        ]
+        
+        emails = self.connector.get_emails(['41'])
+        
+        self.assertEqual(list(emails), ['41'])
+        self.assertEqual(emails['41']['Subject'], 'First')
+        self.connector.conn.uid.assert_called_with(
+            'FETCH', '41',
+            '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)])'
+        )
 
     def test_move_email(self):
         """Test moving an email to another folder."""
-        self.connector.conn.copy.return_value = ('OK', None)
-        self.connector.conn.store.return_value = ('OK', None)
+        self.connector.conn.uid.return_value = ('OK', None)
         self.connector.conn.expunge.return_value = ('OK', None)
         
         result = self.connector.move_email('1', 'Archives')
         
         self.assertTrue(result)
-        self.connector.conn.copy.assert_called_once_with('1', 'Archives')
-        self.connector.conn.store.assert_called_once_with(
-            '1', '+FLAGS', '(\Deleted)'
+        self.connector.conn.uid.assert_any_call('COPY', '1', 'Archives')
+        self.connector.conn.uid.assert_called_with(
+            'STORE', '1', '+FLAGS', '(\Deleted)'
         )
+        # Expunging is left to the caller, once per batch
+        self.connector.conn.expunge.assert_not_called()
+
+    def test_expunge(self):
+        """Test expunging emails marked as deleted."""
+        self.connector.conn.expunge.return_value = ('OK', [b'1'])
+        
+        result = self.connector.expunge()
+        
+        self.assertTrue(result)
         self.connector.conn.expunge.assert_called_once()
 
+    def test_noop(self):
+        """Test keeping the connection alive with NOOP."""
+        self.connector.conn.noop.return_value = ('OK', [None])
+        
+        self.assertTrue(self.connector.noop())
+        
+        self.connector.conn.noop.side_effect = OSError('Connection reset')
+        self.assertFalse(self.connector.noop())
+
+    @patch('imap_connector.select.select')
+    def test_idle(self, mock_select):
+        """Test waiting for a new email with IDLE."""
+        self.connector._has_idle = True
+        self.connector.conn._new_tag.return_value = b'A001'
+        self.connector.conn.file = MagicMock()
+        self.connector.conn.file.peek.return_value = b''
+        self.connector.conn.readline.side_effect = [
+            b'+ idling\r\n',
+            b'* 4 EXISTS\r\n',
+            b'A001 OK IDLE terminated\r\n'
+        ]
+        mock_select.return_value = ([True], [], [])
+        
+        self.assertTrue(self.connector.idle(timeout=60))
+        
+        self.connector.conn.send.assert_any_call(b'A001 IDLE\r\n')
+        self.connector.conn.send.assert_called_with(b'DONE\r\n')
+
+    @patch('imap_connector.select.select')
+    def test_idle_timeout(self, mock_select):
+        """Test that IDLE ends quietly when nothing arrives in time."""
+        self.connector._has_idle = True
+        self.connector.conn._new_tag.return_value = b'A001'
+        self.connector.conn.file = MagicMock()
+        self.connector.conn.file.peek.return_value = b''
+        self.connector.conn.readline.side_effect = [
+            b'+ idling\r\n',
+            b'A001 OK IDLE terminated\r\n'
+        ]
+        mock_select.return_value = ([], [], [])
+        
+        self.assertTrue(self.connector.idle(timeout=60))
+        self.connector.conn.send.assert_called_with(b'DONE\r\n')
+
+    def test_idle_exists_already_received(self):
+        """Test that IDLE isn't started for an already reported email."""
+        self.connector._has_idle = True
+        self.connector.conn.untagged_responses = {'EXISTS': [b'5']}
+        
+        self.assertTrue(self.connector.idle(timeout=60))
+        
+        self.connector.conn.send.assert_not_called()
+        self.assertNotIn('EXISTS', self.connector.conn.untagged_responses)
+
+    @patch('imap_connector.select.select')
+    def test_idle_exists_already_buffered(self, mock_select):
+        """Test that an EXISTS received with the continuation is seen."""
+        self.connector._has_idle = True
+        self.connector.conn._new_tag.return_value = b'A001'
+        # Both lines arrived in one packet, so the socket has nothing
+        # left but imaplib's reader still holds the EXISTS line
+        self.connector.conn.file = MagicMock()
+        self.connector.conn.file.peek.return_value = b'* 4 EXISTS\r\n'
+        self.connector.conn.readline.side_effect = [
+            b'+ idling\r\n',
+            b'* 4 EXISTS\r\n',
+            b'A001 OK IDLE terminated\r\n'
+        ]
+        mock_select.return_value = ([], [], [])
+        
+        self.assertTrue(self.connector.idle(timeout=60))
+        
+        mock_select.assert_not_called()
+        self.connector.conn.send.assert_called_with(b'DONE\r\n')
+
+    def test_move_email_with_move_extension(self):
+        """Test moving an email with a single MOVE command."""
+        self.connector._has_move = True
+        self.connector.conn.uid.return_value = ('OK', None)
+        
+        result = self.connector.move_email('1', 'Archives')
+        
+        self.assertTrue(result)
+        self.connector.conn.uid.assert_called_once_with(
+            'MOVE', '1', 'Archives'
+        )
+        self.connector.conn.expunge.assert_not_called()
+
     def test_move_email_copy_failure(self):
         """Test failure when copying an email."""
-        self.connector.conn.copy.return_value = ('NO', 'Copy failed')
+        self.connector.conn.uid.return_value = ('NO', 'Copy failed')
         
         result = self.connector.move_email('1', 'Archives')
         
         self.assertFalse(result)
-        self.connector.conn.copy.assert_called_once()
-        self.connector.conn.store.assert_not_called()
+        self.connector.conn.uid.assert_called_once_with(
+            'COPY', '1', 'Archives'
+        )
         self.connector.conn.expunge.assert_not_called()
 
     def test_move_email_delete_failure(self):
         """Test failure when deleting an email after copying."""
-        self.connector.conn.copy.return_value = ('OK', None)
-        self.connector.conn.store.return_value = ('NO', 'Delete failed')
+        self.connector.conn.uid.side_effect = [
+            ('OK', None), ('NO', 'Delete failed')
+        ]
         
         result = self.connector.move_email('1', 'Archives')
         
         self.assertFalse(result)
-        self.connector.conn.copy.assert_called_once()
-        self.connector.conn.store.assert_called_once()
+        self.assertEqual(self.connector.conn.uid.call_count, 2)
+        self.connector.conn.expunge.assert_not_called()
+
+    def test_move_emails(self):
+        """Test moving several emails with one command per step."""
+        self.connector.conn.uid.side_effect = [
+            ('OK', None), ('NO', 'Copy failed'), ('OK', None)
+        ]
+        self.connector.conn.expunge.return_value = ('OK', None)
+
+        result = self.connector.move_emails([
+            ('1', 'Archives'), ('2', 'Spam'), ('3', 'Archives')
+        ])
+
+        self.assertEqual(result, ['1', '3'])
+        self.connector.conn.uid.assert_any_call('COPY', '1,3', 'Archives')
+        self.connector.conn.uid.assert_any_call('COPY', '2', 'Spam')
+        self.connector.conn.uid.assert_called_with(
+            'STORE', '1,3', '+FLAGS', '(\Deleted)'
+        )
+        self.connector.conn.expunge.assert_called_once()
+
+    def test_move_emails_with_move_extension(self):
+        """Test moving several emails with one MOVE per folder."""
+        self.connector._has_move = True
+        self.connector.conn.uid.return_value = ('OK', None)
+
+        result = self.connector.move_emails([
+            ('1', 'Archives'), ('2', 'Spam'), ('3', 'Archives')
+        ])
+
+        self.assertEqual(result, ['1', '3', '2'])
+        self.connector.conn.uid.assert_any_call('MOVE', '1,3', 'Archives')
+        self.connector.conn.uid.assert_any_call('MOVE', '2', 'Spam')
+        self.assertEqual(self.connector.conn.uid.call_count, 2)
+        self.connector.conn.expunge.assert_not_called()
+
+    def test_move_emails_delete_failure(self):
+        """Test that copied emails count as moved if deleting fails."""
+        self.connector.conn.uid.side_effect = [
+            ('OK', None), ('NO', 'Delete failed')
+        ]
+
+        result = self.connector.move_emails([('1', 'Archives')])
+
+        self.assertEqual(result, ['1'])
         self.connector.conn.expunge.assert_not_called()
 
     def test_context_manager(self):
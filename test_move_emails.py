@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import email
+import unittest
+from unittest.mock import MagicMock
+
+from move_emails import filter_emails_by_content
+
+
+def headers(subject, sender):
+    """Build a message holding only Subject and From headers."""
+    return email.message_from_string(f"Subject: {subject}\nFrom: {sender}\n\n")
+
+
+class TestFilterEmailsByContent(unittest.TestCase):
+    """Test cases for filter_emails_by_content."""
+
+    def setUp(self):
+        """Set up a mocked connector holding three emails."""
+        self.imap = MagicMock()
+        self.imap.get_emails_headers.return_value = {
+            '1': headers("Weekly newsletter", "news@example.com"),
+            '2': headers("Invoice", "billing@example.com"),
+            '3': headers("", "")
+        }
+
+    def test_plain_text_patterns_searched_on_server(self):
+        """Test that plain-text patterns, dots included, become a SEARCH."""
+        self.imap.search_emails.return_value = ['2']
+
+        filtered = filter_emails_by_content(
+            self.imap, ['1', '2', '3'], subject_pattern="Invoice",
+            sender_pattern="billing@example.com", criteria="UNSEEN"
+        )
+
+        self.imap.search_emails.assert_called_once_with(
+            '(UNSEEN HEADER Subject "Invoice" FROM "billing@example.com")'
+        )
+        self.imap.get_emails_headers.assert_called_once_with(
+            ['2'], "SUBJECT FROM"
+        )
+        self.assertEqual(
+            filtered, [('2', "Invoice", "billing@example.com")]
+        )
+
+    def test_regex_patterns_matched_locally(self):
+        """Test that regex patterns are matched on the fetched headers."""
+        filtered = filter_emails_by_content(
+            self.imap, ['1', '2', '3'], subject_pattern="^(Weekly|Daily) "
+        )
+
+        self.imap.search_emails.assert_not_called()
+        self.assertEqual(
+            filtered, [('1', "Weekly newsletter", "news@example.com")]
+        )
+
+    def test_no_patterns(self):
+        """Test that every email is kept, up to the limit."""
+        filtered = filter_emails_by_content(
+            self.imap, ['1', '2', '3'], limit=2
+        )
+
+        self.assertEqual([email_id for email_id, _, _ in filtered],
+                         ['1', '2'])
+
+        filtered = filter_emails_by_content(self.imap, ['3'])
+        self.assertEqual(filtered, [('3', "(no subject)", "(unknown)")])
+
+
+if __name__ == "__main__":
+    unittest.main()
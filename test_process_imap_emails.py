@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+from email.message import EmailMessage
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from process_imap_emails import (
+    IDLE_TIMEOUT, NOOP_INTERVAL, POLL_INTERVAL, classify_emails,
+    fetch_emails_in_batches, load_modseqs, main, prefetch,
+    process_unread_emails, save_modseqs, setup_argparser, wait_for_next_poll
+)
+
+KEY = "test@example.com@test.example.com/INBOX"
+ARCHIVE = '{"action": "archive"}'
+SPAM = '{"action": "spam"}'
+
+
+def message(subject, body="Hello"):
+    """Build a plain-text email."""
+    msg = EmailMessage()
+    msg["From"] = "sender@example.com"
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
+
+
+@patch('flag.query_ollama', return_value=ARCHIVE)
+@patch('flag.query_ollama_batch')
+class TestClassifyEmails(unittest.TestCase):
+    """Test cases for classifying a group of emails at once."""
+
+    def test_cached_and_batched(self, mock_batch, mock_single):
+        """Test that only emails missing from the cache are asked about."""
+        cache = MagicMock()
+        cache.get.side_effect = lambda text: SPAM if "Sale" in text else None
+        mock_batch.return_value = {'2': ARCHIVE, '3': SPAM}
+        items = [('1', message("Sale")), ('2', message("Receipt")),
+                 ('3', message("Prize"))]
+
+        results = classify_emails(items, cache)
+
+        self.assertEqual(results, [
+            ('1', 'Spam', None), ('2', 'Archives', None), ('3', 'Spam', None)
+        ])
+        batch = mock_batch.call_args.args[0]
+        self.assertEqual([email_id for email_id, _ in batch], ['2', '3'])
+        mock_single.assert_not_called()
+        self.assertEqual(cache.set.call_count, 2)
+
+    def test_long_and_missing_emails_asked_alone(self, mock_batch,
+                                                 mock_single):
+        """Test that long emails and those the model skipped are retried."""
+        mock_batch.return_value = {'1': SPAM}
+        items = [('1', message("Prize")), ('2', message("Receipt")),
+                 ('3', message("Report", "word " * 400))]
+
+        results = classify_emails(items)
+
+        self.assertEqual(results, [
+            ('1', 'Spam', None), ('2', 'Archives', None),
+            ('3', 'Archives', None)
+        ])
+        batch = mock_batch.call_args.args[0]
+        self.assertEqual([email_id for email_id, _ in batch], ['1', '2'])
+        self.assertEqual(mock_single.call_count, 2)
+
+    def test_failed_batch(self, mock_batch, mock_single):
+        """Test that a failed batch falls back to one query per email."""
+        mock_batch.side_effect = requests.ConnectionError("Ollama is down")
+        items = [('1', message("Receipt")), ('2', message("Invoice"))]
+
+        results = classify_emails(items)
+
+        self.assertEqual(results, [
+            ('1', 'Archives', None), ('2', 'Archives', None)
+        ])
+        self.assertEqual(mock_single.call_count, 2)
+
+    def test_cache_set_failure(self, mock_batch, mock_single):
+        """Test that a failure to cache a decision doesn't lose it."""
+        cache = MagicMock()
+        cache.get.return_value = None
+        cache.set.side_effect = requests.ConnectionError("No embeddings")
+
+        results = classify_emails([('1', message("Receipt"))], cache)
+
+        self.assertEqual(results, [('1', 'Archives', None)])
+
+    def test_unparseable_decisions(self, mock_batch, mock_single):
+        """Test that decisions without an action are neither used nor kept."""
+        cache, seen = MagicMock(), MagicMock()
+        cache.get.return_value = None
+        seen.get.return_value = ''
+        mock_single.return_value = '{"reason": "?"}'
+
+        results = classify_emails([('1', message("Receipt"))], cache, seen)
+
+        self.assertIsInstance(results[0][2], ValueError)
+        mock_single.assert_called_once()
+        cache.set.assert_not_called()
+        seen.set.assert_not_called()
+
+
+class TestModseqState(unittest.TestCase):
+    """Test cases for searching only emails changed since the last run."""
+
+    def setUp(self):
+        """Set up a mocked connector with one unread email."""
+        self.imap = MagicMock()
+        self.imap.username = "test@example.com"
+        self.imap.server = "test.example.com"
+        self.imap.uid_validity = 1
+        self.imap.highest_modseq = 12
+        self.imap.select_folder.return_value = True
+        self.imap.search_emails.return_value = ['41']
+        self.imap.get_emails.return_value = {'41': message("Receipt")}
+        self.imap.move_emails.return_value = ['41']
+        self.args = setup_argparser().parse_args(['--no-cache'])
+
+        patcher = patch(
+            'flag.query_ollama',
+            return_value='{"action": "archive"}'
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_save_and_load(self):
+        """Test that saved mod-sequences are loaded back."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "modseq_state.json")
+            self.assertEqual(load_modseqs(path), {})
+
+            save_modseqs({KEY: {"modseq": 12, "uidvalidity": 1}}, path)
+            self.assertEqual(
+                load_modseqs(path), {KEY: {"modseq": 12, "uidvalidity": 1}}
+            )
+
+            with open(path, "w") as f:
+                f.write("{not json")
+            self.assertEqual(load_modseqs(path), {})
+
+    def test_searches_changed_emails_only(self):
+        """Test that only emails changed since the last run are searched."""
+        modseqs = {KEY: {"modseq": 10, "uidvalidity": 1}}
+
+        self.assertEqual(
+            process_unread_emails(self.imap, self.args, modseqs=modseqs), 0
+        )
+
+        self.imap.search_emails.assert_called_once_with("MODSEQ 11 UNSEEN")
+        self.imap.move_emails.assert_called_once_with([('41', 'Archives')])
+        self.assertEqual(modseqs[KEY], {"modseq": 12, "uidvalidity": 1})
+
+    def test_skips_unchanged_folder(self):
+        """Test that nothing is searched if the folder hasn't changed."""
+        modseqs = {KEY: {"modseq": 12, "uidvalidity": 1}}
+
+        process_unread_emails(self.imap, self.args, modseqs=modseqs)
+
+        self.imap.search_emails.assert_not_called()
+
+    def test_uidvalidity_change(self):
+        """Test that the whole folder is searched after a UIDVALIDITY reset."""
+        modseqs = {KEY: {"modseq": 10, "uidvalidity": 2}}
+
+        process_unread_emails(self.imap, self.args, modseqs=modseqs)
+
+        self.imap.search_emails.assert_called_once_with("UNSEEN")
+        self.assertEqual(modseqs[KEY], {"modseq": 12, "uidvalidity": 1})
+
+    def test_failed_move_keeps_modseq(self):
+        """Test that an email that failed to move is searched for again."""
+        self.imap.move_emails.return_value = []
+        modseqs = {KEY: {"modseq": 10, "uidvalidity": 1}}
+
+        process_unread_emails(self.imap, self.args, modseqs=modseqs)
+
+        self.assertEqual(modseqs[KEY], {"modseq": 10, "uidvalidity": 1})
+
+    def test_failed_decision_keeps_modseq(self):
+        """Test that an email Ollama failed on is searched for again."""
+        modseqs = {KEY: {"modseq": 10, "uidvalidity": 1}}
+
+        with patch('flag.query_ollama',
+                   side_effect=ValueError("Ollama error")):
+            process_unread_emails(self.imap, self.args, modseqs=modseqs)
+
+        self.imap.move_emails.assert_called_once_with([])
+        self.assertEqual(modseqs[KEY], {"modseq": 10, "uidvalidity": 1})
+
+    def test_dry_run_keeps_modseq(self):
+        """Test that a dry run doesn't record emails as handled."""
+        self.args.dry_run = True
+        modseqs = {}
+
+        process_unread_emails(self.imap, self.args, modseqs=modseqs)
+
+        self.imap.move_emails.assert_not_called()
+        self.assertEqual(modseqs, {})
+
+
+class TestPolling(unittest.TestCase):
+    """Test cases for fetching ahead and waiting between polls."""
+
+    def test_fetch_emails_in_batches(self):
+        """Test that emails are fetched a batch at a time."""
+        imap = MagicMock()
+        imap.get_emails.side_effect = lambda ids: {
+            email_id: "msg" for email_id in ids if email_id != '2'
+        }
+
+        batches = list(fetch_emails_in_batches(imap, ['1', '2', '3'], 2))
+
+        self.assertEqual(batches, [
+            [('1', "msg"), ('2', None)], [('3', "msg")]
+        ])
+
+    def test_prefetch_reraises_errors(self):
+        """Test that an error while producing reaches the consumer."""
+        def produce():
+            yield 1
+            raise OSError("Connection reset")
+
+        items = prefetch(produce())
+
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(OSError):
+            next(items)
+
+    def test_wait_with_idle(self):
+        """Test that IDLE is used when the server supports it."""
+        imap = MagicMock()
+        imap.supports_idle = True
+        imap.idle.return_value = True
+
+        self.assertTrue(wait_for_next_poll(imap, 60))
+
+        imap.idle.assert_called_once_with(IDLE_TIMEOUT)
+        imap.noop.assert_not_called()
+
+    @patch('process_imap_emails.time')
+    def test_wait_with_noop(self, mock_time):
+        """Test sleeping with a NOOP whenever the connection idles."""
+        clock = [0]
+        mock_time.monotonic.side_effect = lambda: clock[0]
+        mock_time.sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        imap = MagicMock()
+        imap.supports_idle = False
+        imap.noop.return_value = True
+
+        self.assertTrue(wait_for_next_poll(imap, 2 * NOOP_INTERVAL + 10))
+        self.assertEqual(imap.noop.call_count, 2)
+
+        imap.noop.return_value = False
+        self.assertFalse(wait_for_next_poll(imap, 2 * NOOP_INTERVAL + 10))
+
+    @patch('process_imap_emails.save_modseqs')
+    @patch('process_imap_emails.load_modseqs', return_value={})
+    @patch('process_imap_emails.wait_for_next_poll', return_value=False)
+    @patch('process_imap_emails.process_unread_emails', return_value=0)
+    @patch('process_imap_emails.IMAPConnector')
+    def test_daemon_stops_when_connection_lost(self, mock_connector,
+                                               mock_process, mock_wait,
+                                               mock_load, mock_save):
+        """Test that the daemon loop ends once the connection is lost."""
+        imap = mock_connector.return_value.__enter__.return_value
+        imap.logged_in = True
+
+        with patch('sys.argv', ['process_imap_emails.py', '--daemon',
+                                '--no-cache']):
+            self.assertEqual(main(), 1)
+
+        mock_process.assert_called_once()
+        mock_wait.assert_called_once_with(imap, POLL_INTERVAL)
+        mock_save.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()